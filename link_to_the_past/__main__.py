@@ -15,7 +15,7 @@ import logging
 import sys
 import time
 
-from link_to_the_past import create, restore, edit, compare, profile
+from link_to_the_past import create, restore, edit, compare, profile, watch
 from link_to_the_past.error import BackupException
 
 
@@ -93,7 +93,7 @@ def main():
 
     subparsers = parser.add_subparsers(metavar='ACTION')
     # get the subcommands from the other modules
-    for module in (create, edit, compare, restore):
+    for module in (create, edit, compare, restore, watch):
         module.update_argparse(subparsers)
     args = parser.parse_args()
 
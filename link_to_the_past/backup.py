@@ -12,7 +12,7 @@ import os
 import glob
 import logging
 
-from . import config_file_parser, profile, indexer
+from . import config_file_parser, profile, indexer, filelist, compact, hash_cache, hashes
 from .error import BackupException
 
 
@@ -25,7 +25,13 @@ class Backup(object):
         self.last_backup_path = None
         self.base_name = None
         self.hash_name = None
+        self.file_list_format = 'p1'
+        self.compact_file_lists = False
+        self.block_size = None
         self.indexer = None
+        self.policy = indexer.FilePolicy()
+        self.hash_cache = False
+        self.change_detection = 'mtime'
 
     def set_target_path(self, path):
         """Set the path to the backups (a directory)"""
@@ -52,12 +58,24 @@ class Backup(object):
         else:
             logging.info('No previous backup found')
 
+    def new_file_list(self):
+        """Return an empty file list, of the type selected in the configuration"""
+        if self.compact_file_lists:
+            file_list = compact.CompactFileList()
+        else:
+            file_list = filelist.FileList()
+        if self.block_size is not None:
+            file_list.block_size = self.block_size
+        return file_list
+
     def load_configuration(self, filename):
         logging.debug('Loading configuration {}'.format(filename))
         c = BackupControl(self)
         c.load_file(filename)
         if self.target_path is None:
             raise BackupException('Configuration misses TARGET directive')
+        if self.policy.enable_checksum and hashes.get_factory(self.hash_name) is hashes.NoHash:
+            raise BackupException('enable_checksum needs a HASH directive')
 
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
@@ -101,12 +119,104 @@ class BackupControl(config_file_parser.ControlFileParser):
         if self.backup.indexer is not None:
             self.backup.indexer.excludes.append(indexer.ShellPattern(self.path(path)))
 
+    def word_exclude_caches(self):
+        """skip the contents of directories with a CACHEDIR.TAG file"""
+        if self.backup.indexer is not None:
+            self.backup.indexer.exclude_caches = True
+
+    def word_exclude_if_present(self):
+        """skip the contents of directories containing a file with that name"""
+        name = self.next_word()
+        if self.backup.indexer is not None:
+            self.backup.indexer.markers.add(name)
+
+    def word_max_file_size(self):
+        """skip files larger than that many bytes"""
+        size = int(self.next_word())
+        if size < 0:
+            raise BackupException('max. file size must not be negative: {}'.format(size))
+        if self.backup.indexer is not None:
+            self.backup.indexer.max_file_size = size
+
     def word_hash(self):
         """Set the hash function"""
         if self.backup.hash_name is not None:
             logging.warn('HASH directive found multiple times')
         self.backup.hash_name = self.next_word()
 
+    def word_enable_checksum(self):
+        """only hash files matching this and other enable_checksum patterns"""
+        self.backup.policy.enable_checksum.append(indexer.ShellPattern(self.path(self.next_word())))
+
+    def word_no_checksum(self):
+        """do not hash files matching the pattern"""
+        self.backup.policy.no_checksum.append(indexer.ShellPattern(self.path(self.next_word())))
+
+    def word_force_copy(self):
+        """always copy files matching the pattern, even if unchanged"""
+        self.backup.policy.force_copy.append(indexer.ShellPattern(self.path(self.next_word())))
+
+    def word_fingerprint(self):
+        """detect changes of matching files by a fingerprint of some blocks"""
+        self.backup.policy.fingerprint.append(indexer.ShellPattern(self.path(self.next_word())))
+
+    def word_file_list_format(self):
+        """Set the format used to write file lists"""
+        file_format = self.next_word()
+        if file_format not in filelist.FILE_LIST_FORMATS:
+            raise BackupException('unknown file list format: {!r}'.format(file_format))
+        self.backup.file_list_format = file_format
+
+    def word_compact_file_lists(self):
+        """Keep file lists in memory in a compact form"""
+        self.backup.compact_file_lists = True
+
+    def word_block_size(self):
+        """set the size of the blocks used to read and write files"""
+        block_size = int(self.next_word())
+        if block_size <= 0:
+            raise BackupException('block size must be positive: {}'.format(block_size))
+        self.backup.block_size = block_size
+
+    def word_scan_threads(self):
+        """set the number of threads used to scan the source"""
+        threads = int(self.next_word())
+        if self.backup.indexer is not None:
+            self.backup.indexer.scan_threads = threads
+
+    def word_copy_threads(self):
+        """set the number of threads used to copy/link files to the backup"""
+        self.backup.copy_threads = int(self.next_word())
+
+    def word_no_move_detection(self):
+        """do not use inode numbers to find moved files"""
+        self.backup.detect_moves = False
+
+    def word_deduplicate(self):
+        """hard link files with the same contents instead of copying them"""
+        self.backup.deduplicate = True
+
+    def word_streaming(self):
+        """copy files while the source is still scanned"""
+        self.backup.streaming = True
+
+    def word_scan_cache(self):
+        """remember directory listings to scan unchanged directories faster"""
+        self.backup.scan_cache = True
+
+    def word_hash_cache(self):
+        """keep hashes of source files in extended attributes (see hash_cache)"""
+        if not hash_cache.is_supported():
+            raise BackupException('extended attributes are not supported on this system')
+        self.backup.hash_cache = True
+
+    def word_change_detection(self):
+        """how changed files are detected: mtime (and size) or also ctime and inode"""
+        mode = self.next_word()
+        if mode not in ('mtime', 'ctime'):
+            raise BackupException('unknown change detection: {!r}'.format(mode))
+        self.backup.change_detection = mode
+
     def word_load_config(self):
         """include an other configuration file"""
         c = self.__class__(self.backup)  # create a new instance of the same class
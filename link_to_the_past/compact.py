@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# (C) 2012-2016 Chris Liechti <cliechti@gmx.net>
+#
+# SPDX-License-Identifier:    BSD-3-Clause
+"""\
+Link To The Past - a backup tool
+
+Compact file lists.
+
+CompactFileList stores the tree in columns: the meta data is kept in typed
+arrays, names are interned and each entry only knows the index of its
+parent. The entries are represented by light weight proxy objects that are
+created on demand and read and write the columns. They are subclasses of
+BackupFile and BackupDirectory so the rest of the program can use them
+unchanged.
+
+This uses less than a third of the memory per entry, at the cost of being
+somewhat slower.
+"""
+import array
+import collections.abc
+import os
+import stat
+import sys
+
+from . import filelist
+from .string_escape import escaped
+
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+class Column(object):
+    """\
+    A typed array with a special value that represents None.
+
+    >>> c = Column('q', -1)
+    >>> c.append(None)
+    >>> c.append(42)
+    >>> c[0], c[1]
+    (None, 42)
+    >>> c = Column('d', float('nan'))
+    >>> c.append(None)
+    >>> c.append(1.5)
+    >>> c[0], c[1]
+    (None, 1.5)
+    """
+
+    __slots__ = ['values', 'none']
+
+    def __init__(self, typecode, none):
+        self.values = array.array(typecode)
+        self.none = none
+
+    def __getitem__(self, index):
+        value = self.values[index]
+        # NaN is not equal to itself, that is used for floats
+        if value == self.none or value != value:
+            return None
+        return value
+
+    def __setitem__(self, index, value):
+        self.values[index] = self.none if value is None else value
+
+    def append(self, value):
+        self.values.append(self.none if value is None else value)
+
+
+# columns used for the Stat fields: (name, typecode, value used for None)
+STAT_COLUMNS = (
+    ('size', 'q', -1),
+    ('mode', 'i', -1),
+    ('uid', 'q', -1),
+    ('gid', 'q', -1),
+    ('atime', 'd', float('nan')),
+    ('mtime', 'd', float('nan')),
+    ('ctime', 'd', float('nan')),
+    ('flags', 'q', -1),
+    ('allocated', 'q', -1),
+    ('dev', 'Q', 0xffffffffffffffff),
+    ('ino', 'Q', 0xffffffffffffffff),
+)
+
+
+def _column_property(name):
+    """Create a property that accesses the column with given name"""
+    def fget(self):
+        return self._columns[name][self._index]
+
+    def fset(self, value):
+        self._columns[name][self._index] = value
+    return property(fget, fset)
+
+
+class CompactStat(filelist.Stat):
+    """Proxy for the meta data of an entry, stored in the columns"""
+
+    __slots__ = ['_columns', '_index']
+
+    def __init__(self, columns, index):
+        self._columns = columns
+        self._index = index
+
+for _name, _typecode, _none in STAT_COLUMNS:
+    setattr(CompactStat, _name, _column_property(_name))
+
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+class CompactEntry(object):
+    """Mixin for the proxies, accessing the columns of the file list"""
+
+    __slots__ = []
+
+    @property
+    def name(self):
+        return self.filelist._names[self._index]
+
+    @property
+    def parent(self):
+        parent = self.filelist._proxy(self.filelist._parents[self._index])
+        if self._path is not None and parent._path is None:
+            parent._path = os.path.dirname(self._path)
+        return parent
+
+    @property
+    def stat(self):
+        if self._stat is None:
+            self._stat = CompactStat(self.filelist._columns, self._index)
+        return self._stat
+
+    @property
+    def data_hash(self):
+        return self.filelist._hashes[self._index]
+
+    @data_hash.setter
+    def data_hash(self, value):
+        self.filelist._hashes[self._index] = value
+
+    @property
+    def fingerprint(self):
+        return self.filelist._fingerprints.get(self._index)
+
+    @fingerprint.setter
+    def fingerprint(self, value):
+        if value is None:
+            self.filelist._fingerprints.pop(self._index, None)
+        else:
+            self.filelist._fingerprints[self._index] = value
+
+    @property
+    def changed(self):
+        return bool(self.filelist._changed[self._index])
+
+    @changed.setter
+    def changed(self, value):
+        self.filelist._changed[self._index] = value
+
+
+class CompactFile(CompactEntry, filelist.BackupFile):
+    """Proxy for a file in a CompactFileList"""
+
+    __slots__ = ['_index', '_stat']
+
+
+class CompactEntries(collections.abc.Mapping):
+    """\
+    Read-only view of the entries of a directory, name -> proxy. Entries are
+    added with new_dir and new_file.
+    """
+
+    __slots__ = ['_directory']
+
+    def __init__(self, directory):
+        self._directory = directory
+
+    def __getitem__(self, name):
+        directory = self._directory
+        index = directory.filelist._find(directory._index, name)
+        if index is None:
+            raise KeyError(name)
+        return directory.filelist._proxy(index, os.path.join(directory.path, name))
+
+    def __iter__(self):
+        return (entry.name for entry in self._directory._iter_entries())
+
+    def __len__(self):
+        return len(self._directory.filelist._directories.get(self._directory._index, ()))
+
+    def values(self):
+        return self._directory._iter_entries()
+
+    def items(self):
+        return ((entry.name, entry) for entry in self._directory._iter_entries())
+
+
+class CompactDirectoryMixin(object):
+    """\
+    Directory operations, working on the children of the entry with the
+    index _index. Used by the directory proxies and the root.
+    """
+
+    __slots__ = []
+
+    @property
+    def entries(self):
+        """Read-only view of the entries (see CompactEntries)"""
+        return CompactEntries(self)
+
+    def _iter_entries(self):
+        """Generator yielding proxies for all entries of this directory"""
+        filelist = self.filelist
+        names = filelist._names
+        prefix = self.path
+        if not prefix.endswith(os.sep):
+            prefix += os.sep
+        for index in filelist._directories.get(self._index, ()):
+            yield filelist._proxy(index, prefix + names[index])
+
+    def flattened(self, include_self=False):
+        """Generator yielding all directories and files recursively"""
+        if include_self:
+            yield self
+        for entry in self._iter_entries():
+            yield entry
+            if isinstance(entry, filelist.BackupDirectory):
+                for x in entry.flattened():
+                    yield x
+
+    def walk(self, recursive=True):
+        """Generator yielding all directories and files recursively"""
+        files = []
+        dirs = []
+        for entry in self._iter_entries():
+            if isinstance(entry, filelist.BackupDirectory):
+                dirs.append(entry)
+            else:
+                files.append(entry)
+        yield self.path, dirs, files
+        if recursive:
+            for directory in dirs:
+                for x in directory.walk():
+                    yield x
+
+    def __getitem__(self, name):
+        if os.sep in name:
+            head, tail = name.split(os.sep, 1)
+        else:
+            head, tail = name, None
+        index = self.filelist._find(self._index, head)
+        if index is None:
+            raise KeyError('no such file or directory: {}'.format(escaped(name)))
+        entry = self.filelist._proxy(index, os.path.join(self.path, head))
+        if tail is None:
+            return entry
+        return entry[tail]  # XXX only if dir
+
+    def new_dir(self, name, stat_now=None):
+        """Create a new sub-directory in this directory"""
+        return self.filelist._new_entry(self._index, self.path, name, True, stat_now)
+
+    def new_file(self, name, stat_now=None):
+        """Create a new file in this directory"""
+        return self.filelist._new_entry(self._index, self.path, name, False, stat_now)
+
+    def __iter__(self):
+        return self._iter_entries()
+
+
+class CompactDirectory(CompactEntry, CompactDirectoryMixin, filelist.BackupDirectory):
+    """Proxy for a directory in a CompactFileList"""
+
+    __slots__ = ['_index', '_stat']
+
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+class CompactFileList(CompactDirectoryMixin, filelist.FileList):
+    """\
+    Manage a tree of files and directories, stored in columns.
+
+    The root itself is a normal object, it uses the index -1.
+    """
+
+    _index = -1
+
+    def __init__(self):
+        filelist.FileList.__init__(self)
+        self._names = []
+        self._parents = array.array('i')
+        self._hashes = []
+        self._fingerprints = {}     # index -> fingerprint, only few files have one
+        self._changed = bytearray()
+        self._columns = dict((name, Column(typecode, none)) for name, typecode, none in STAT_COLUMNS)
+        self._directories = {-1: array.array('i')}    # index of directory -> indexes of its entries
+        self._lookups = {}  # index of directory -> {name: index}, built on the first lookup
+
+    # the root is a normal BackupDirectory, but its entries are in the
+    # columns. BackupDirectory.__init__ assigns an empty dict, ignore that
+    entries = property(CompactDirectoryMixin.entries.fget, lambda self, value: None)
+
+    def __getitem__(self, name):
+        if name == self.name:
+            return self
+        if name.startswith(self.name):
+            name = name[len(self.name):]
+        return CompactDirectoryMixin.__getitem__(self, name)
+
+    def _proxy(self, index, path=None):
+        """Return an object representing the entry with given index"""
+        if index == -1:
+            return self
+        if index in self._directories:
+            entry = CompactDirectory.__new__(CompactDirectory)
+        else:
+            entry = CompactFile.__new__(CompactFile)
+        entry._index = index
+        entry._stat = None
+        entry.filelist = self
+        entry._path = path
+        return entry
+
+    def _find(self, parent_index, name):
+        """Return the index of the entry with given name in a directory or None"""
+        lookup = self._lookups.get(parent_index)
+        if lookup is None:
+            if parent_index not in self._directories:
+                return None
+            names = self._names
+            lookup = self._lookups[parent_index] = {}
+            for index in self._directories[parent_index]:
+                lookup.setdefault(names[index], index)
+        return lookup.get(name)
+
+    def _append(self, parent_index, name, is_dir):
+        """Add a new entry to the columns, return its index"""
+        index = len(self._names)
+        self._names.append(sys.intern(name))
+        self._parents.append(parent_index)
+        self._hashes.append('-')
+        self._changed.append(1)
+        for column in self._columns.values():
+            column.append(None)
+        self._columns['size'].values[index] = 0
+        if is_dir:
+            self._directories[index] = array.array('i')
+        self._directories[parent_index].append(index)
+        lookup = self._lookups.get(parent_index)
+        if lookup is not None:
+            lookup.setdefault(name, index)
+        return index
+
+    def _new_entry(self, parent_index, parent_path, name, is_dir, stat_now):
+        """\
+        Create a new entry. Unlike with BackupDirectory, an existing entry
+        with the same name is not replaced, names must be unique.
+        """
+        index = self._append(parent_index, name, is_dir)
+        entry = self._proxy(index, os.path.join(parent_path, name))
+        if stat_now is not None:
+            entry.stat.extract(stat_now)
+        return entry
+
+    def add_records(self, records):
+        """\
+        Add entries to the tree. See FileList.add_records for the format of
+        the records.
+        """
+        directories = {self.path: -1}
+        last_parent_path = None
+        last_parent = None
+        S_ISDIR = stat.S_ISDIR
+        columns = [self._columns[name] for name in ('mode', 'uid', 'gid', 'size', 'atime', 'mtime', 'flags')]
+        dev = self._columns['dev']
+        ino = self._columns['ino']
+        ctime = self._columns['ctime']
+        for record in records:
+            path = record[0]
+            parent_path, sep, name = path.rpartition(os.sep)
+            if not parent_path:
+                parent_path = os.sep
+            if parent_path != last_parent_path:
+                last_parent = directories.get(parent_path)
+                if last_parent is None:
+                    last_parent = self[parent_path]._index
+                last_parent_path = parent_path
+            is_dir = S_ISDIR(record[1])
+            index = self._append(last_parent, name, is_dir)
+            if is_dir:
+                directories[path] = index
+            for column, value in zip(columns, record[1:8]):
+                column[index] = value
+            self._hashes[index] = record[8]
+            dev[index] = record[9]
+            ino[index] = record[10]
+            ctime[index] = record[11]
+            if record[12] is not None:
+                self._fingerprints[index] = record[12]
@@ -9,11 +9,20 @@ Link To The Past - a backup tool
 
 Compare backups and sources.
 """
+import collections
+import concurrent.futures
+import datetime
 import logging
+import math
 import os
 import sys
+import time
+from . import filelist
+from .backup import Backup
 from .create import Create
+from .integrity import Checkpoint, IntegrityChecker, SampleState, file_keys, select_sample
 from .restore import Restore
+from .speaking import nice_bytes, parse_bytes
 from .string_escape import escaped
 from .error import BackupException
 
@@ -43,70 +52,269 @@ def print_changes(iterator, long_format, show_all=False):
             #~ print "-->", e2
 
 
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+def selected_paths(args):
+    """The absolute PATH arguments or None if there are none"""
+    return [os.path.abspath(path) for path in args.PATH] or None
+
+
+def select_directories(root, paths):
+    """\
+    Return the directories of a file list for the given paths, the root if
+    paths is None. Paths that are not found are reported and skipped.
+    """
+    if paths is None:
+        return [root]
+    directories = []
+    for path in paths:
+        try:
+            entry = root[path]
+        except KeyError as e:
+            logging.error('{}'.format(e.args[0]))
+        else:
+            if isinstance(entry, filelist.BackupDirectory):
+                directories.append(entry)
+            else:
+                logging.error('not a directory: {}'.format(escaped(path)))
+    return directories
+
+
+def matching_directories(root, other, paths):
+    """\
+    Return pairs of directories of two file lists for the given paths, the
+    roots if paths is None. A directory that is only in one of the lists is
+    paired with None (see compare_directories). Paths that are in neither
+    list or are not directories are reported and skipped.
+    """
+    if paths is None:
+        return [(root, other)]
+    pairs = []
+    for path in paths:
+        found = []
+        for file_list in (root, other):
+            try:
+                found.append(file_list[path])
+            except KeyError:
+                found.append(None)
+        if all(entry is None for entry in found):
+            logging.error('no such file or directory: {}'.format(escaped(path)))
+        elif any(entry is not None and not isinstance(entry, filelist.BackupDirectory) for entry in found):
+            logging.error('not a directory: {}'.format(escaped(path)))
+        else:
+            pairs.append(tuple(found))
+    return pairs
+
+
+def compare_directories(directory, other):
+    """\
+    Same as directory.compare(other), but one of them may be None (see
+    matching_directories): then all entries are reported as added or removed.
+    """
+    if other is None:
+        yield (directory.path, filelist.CompareResult(added=[directory]), filelist.CompareResult())
+        for path, dirs, files in directory.walk():
+            yield (path, filelist.CompareResult(added=dirs), filelist.CompareResult(added=files))
+    elif directory is None:
+        yield (other.path, filelist.CompareResult(removed=[other]), filelist.CompareResult())
+        for path, dirs, files in other.walk():
+            yield (path, filelist.CompareResult(removed=dirs), filelist.CompareResult(removed=files))
+    else:
+        for x in directory.compare(other):
+            yield x
+
+
+def files_to_hash(source_root, backup_root, unchanged_only=False):
+    """\
+    Generator yielding the source files that can be compared by hash: the
+    file exists in the backup and has a hash made with the same algorithm.
+    With unchanged_only, only files with the same meta data as in the backup
+    (changed files are reported anyway).
+    """
+    for path, dirs, files in source_root.compare(backup_root):
+        pairs = list(zip(files.same, files.same_other))
+        if not unchanged_only:
+            pairs.extend(zip(files.changed, files.changed_other))
+        for entry, ref_entry in pairs:
+            if ref_entry.data_hash != '-' and ref_entry.filelist.hash_name == entry.filelist.hash_name:
+                yield entry
+
+
+def hash_files(entries, threads):
+    """Update the hashes of source files, using a pool of threads"""
+    def finish(entry, future):
+        try:
+            future.result()
+        except OSError as e:
+            logging.error('Error reading {}: {}'.format(escaped(entry.source_path), e))
+
+    count = 0
+    with concurrent.futures.ThreadPoolExecutor(threads) as executor:
+        pending = collections.deque()
+        for entry in entries:
+            pending.append((entry, executor.submit(entry.update_hash_from_source)))
+            count += 1
+            while len(pending) > threads * 16:
+                finish(*pending.popleft())
+        while pending:
+            finish(*pending.popleft())
+    return count
+
+
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 def action_verify(args):
     """compare hashes in source with saved file list"""
+    paths = selected_paths(args)
     b = Restore()
+    b.paths = paths
     b.evaluate_arguments(args)
-    # XXX allow '.' and find out which dir it is
-    #~ if args:
-        #~ path = os.sep + args[0]
-    #~ else:
-        #~ path = '*'
     scan = Create()
     scan.evaluate_arguments(args)
     scan.source_root.set_hash(scan.hash_name)   # shouldn't this be done automatically?
+    if args.unchanged_only or args.no_hash_cache:
+        # the cache would be trusted for files with unchanged meta data
+        scan.source_root.hash_cache = None
+    # the hashes are compared, a new change time alone (e.g. written by the
+    # hash cache) does not make a difference
+    scan.source_root.change_detection = 'mtime'
+    if paths is not None:
+        scan.indexer.limit_to(paths)
     scan.indexer.scan()
-    # XXX this calculates the hash of added files for which we can not compare the hash. wasted time :/
-    for path, dirs, files in scan.source_root.walk():
-        for entry in files:
-            entry.update_hash_from_source()
-    print_changes(scan.source_root.compare(b.root), args.long)
+    pairs = matching_directories(scan.source_root, b.root, paths)
+    # compare the meta data first, only files that are in the backup are hashed
+    count = hash_files(
+        (entry for source, backup in pairs if source is not None and backup is not None
+         for entry in files_to_hash(source, backup, args.unchanged_only)),
+        args.threads)
+    logging.info('Calculated the hash of {} files'.format(count))
+    if scan.source_root.hash_cache is not None:
+        scan.source_root.hash_cache.save()
+    for source, backup in pairs:
+        print_changes(compare_directories(source, backup), args.long)
+
+
+def load_backup(b, name):
+    """Load the file list of the named backup in the target"""
+    b.current_backup_path = os.path.join(b.target_path, name)
+    b.root = b.new_file_list()
+    b.load_file_list()
+    b.root.root = b.current_backup_path
+
+
+def choose_sample(b, names, state, args):
+    """Choose the files to check in this run, log the coverage"""
+    sizes = {}
+    for name in names:
+        load_backup(b, name)
+        sizes.update(file_keys(b.root))
+    total = sum(sizes.values())
+    if args.sample_bytes is not None:
+        budget = parse_bytes(args.sample_bytes)
+    else:
+        budget = total * args.sample_fraction
+    selected = select_sample(sizes, state, budget)
+    logging.info('Sample: {} of {} files, {} of {} (about {} runs for all files)'.format(
+        len(selected), len(sizes),
+        nice_bytes(sum(sizes[key] for key in selected)), nice_bytes(total),
+        math.ceil(total / budget) if budget else len(sizes)))
+    return sizes, selected
+
+
+def log_coverage(sizes, state):
+    total = sum(sizes.values())
+    verified = [key for key in sizes if key in state.verified]
+    verified_bytes = sum(sizes[key] for key in verified)
+    logging.info('Verified at least once: {} of {} ({:.1f}%)'.format(
+        nice_bytes(verified_bytes), nice_bytes(total),
+        100.0 * verified_bytes / total if total else 100.0))
+    if len(verified) < len(sizes):
+        logging.info('Never verified: {} files, {}'.format(
+            len(sizes) - len(verified), nice_bytes(total - verified_bytes)))
+    elif verified:
+        oldest = min(state.verified[key] for key in verified)
+        logging.info('Oldest verification: {:%Y-%m-%d %H:%M}'.format(datetime.datetime.fromtimestamp(oldest)))
 
 
 def action_integrity(args):
     """compare hashes in backup with saved file list"""
+    paths = selected_paths(args)
     b = Restore()
-    b.evaluate_arguments(args)
-    #~ logging.debug('scanning {}...'.format(b.root))
-    for path, dirs, files in b.root.walk():
-        for entry in dirs:
-            logging.debug('checking {}'.format(escaped(entry.path)))
-            if not os.path.isdir(entry.backup_path):
-                sys.stdout.write('MISSING {}\n'.format(escaped(entry.path)))
-        for entry in files:
-            logging.debug('checking {}'.format(escaped(entry.path)))
-            status = 'OK'
-            if os.path.exists(entry.backup_path):
-                if not entry.verify_hash(entry.backup_path):
-                    status = 'CORRUPTED'
-            else:
-                status = 'MISSING'
-            sys.stdout.write('{} {}\n'.format(status, escaped(entry.path)))
+    b.paths = paths
+    sample = args.sample_bytes is not None or args.sample_fraction is not None
+    if sample and paths is not None:
+        raise BackupException('PATH can not be used with --sample-bytes or --sample-fraction')
+    if args.all or sample:
+        # only load the configuration, all backups are checked below
+        Backup.evaluate_arguments(b, args)
+        names = sorted(b.find_backups())
+    else:
+        b.evaluate_arguments(args)
+        names = [None]
+    if sample:
+        state = SampleState(b.target_path)
+        state.load()
+        sizes, selected = choose_sample(b, names, state, args)
+        checkpoint = None
+    else:
+        selected = None
+        checkpoint = None if args.no_checkpoint else Checkpoint(b.target_path)
+        if checkpoint is not None and args.restart:
+            checkpoint.remove()
+    checker = IntegrityChecker(args.threads, checkpoint, selected)
+    try:
+        with checker:
+            for name in names:
+                if name is not None:
+                    logging.info('Checking backup {}'.format(name))
+                    load_backup(b, name)
+                prefix = '' if name is None else name + ' '
+                for directory in select_directories(b.root, paths):
+                    for status, entry in checker.check(directory):
+                        if status == 'SKIPPED':
+                            continue
+                        if status != 'OK' or not isinstance(entry, filelist.BackupDirectory):
+                            sys.stdout.write('{} {}{}\n'.format(status, prefix, escaped(entry.path)))
+    finally:
+        if sample:
+            # also record the files checked so far when interrupted
+            now = time.time()
+            for key in checker.verified_keys():
+                state.verified[key[:4]] = now
+            state.save(sizes)
+    checker.log_summary()
+    if sample:
+        log_coverage(sizes, state)
 
 
 def action_changes(args):
     """compare changes between two backups"""
+    paths = selected_paths(args)
     if args.TIMESPEC2 == 'now':
         # "now" as word to scan sources instead of loading a backup
         # swap order between b and other as now is "newer"..
         other_backup = Restore()
+        other_backup.paths = paths
         other_backup.evaluate_arguments(args)
         b = Create()
         b.evaluate_arguments(args)
         b.target_path = other_backup.target_path
         b.source_root.set_hash(other_backup.hash_name)   # shoun't this be done automatically?
+        if paths is not None:
+            b.indexer.limit_to(paths)
         b.indexer.scan()
         b.root = b.source_root
     else:
         b = Restore()
+        b.paths = paths
         b.evaluate_arguments(args)
         other_backup = Restore()
+        other_backup.paths = paths
         other_backup.target_path = b.target_path
+        other_backup.root = b.new_file_list()
         other_backup.find_backup_by_time(args.TIMESPEC2)
     if b.current_backup_path == other_backup.current_backup_path:
         raise BackupException('Both TIMESPECs point to the same backup')
-    print_changes(b.root.compare(other_backup.root), args.long, args.all)
+    for directory, other_directory in matching_directories(b.root, other_backup.root, paths):
+        print_changes(compare_directories(directory, other_directory), args.long, args.all)
 
 
 def update_argparse(subparsers):
@@ -117,21 +325,79 @@ def update_argparse(subparsers):
                     'backup. This is a slow operation as it needs to read '
                     'all files.',
         help='compare current files against file list in backup')
+    parser.add_argument('PATH', nargs='*', help='only compare these directories')
     group = parser.add_argument_group('Display Options')
     group.add_argument(
         "-l", "--long",
         help="show detailed file info",
         default=False,
         action='store_true')
+    group = parser.add_argument_group('Verify Options')
+    group.add_argument(
+        "--threads",
+        help="number of files read in parallel (default: %(default)s)",
+        metavar='N',
+        type=int,
+        default=4)
+    group.add_argument(
+        "--unchanged-only",
+        help="only read files whose meta data is unchanged, to find files "
+             "that were modified without updating the meta data (e.g. "
+             "corrupted disks), the hash cache is not used",
+        default=False,
+        action='store_true')
+    group.add_argument(
+        "--no-hash-cache",
+        help="read all files, even if a hash_cache is configured",
+        default=False,
+        action='store_true')
     Restore.populate_arguments(parser)
+    Create.populate_arguments(parser)
     parser.set_defaults(func=action_verify)
 
     parser = subparsers.add_parser(
         'integrity',
         description='Check the files in the backup against modifications by '
                     'comparing them with the checksum in the file list. This '
-                    'is a slow operation as it needs to read all files.',
+                    'is a slow operation as it needs to read all files. '
+                    'Files shared by backups (hard links) are read once. '
+                    'An interrupted check continues where it stopped.',
         help='verify backup against its file list')
+    parser.add_argument('PATH', nargs='*', help='only check these directories')
+    group = parser.add_argument_group('Integrity Options')
+    group.add_argument(
+        "--all",
+        help="check all backups in the target",
+        default=False,
+        action='store_true')
+    group.add_argument(
+        "--threads",
+        help="number of files read in parallel (default: %(default)s)",
+        metavar='N',
+        type=int,
+        default=4)
+    group.add_argument(
+        "--restart",
+        help="do not continue an interrupted check, start from the beginning",
+        default=False,
+        action='store_true')
+    group.add_argument(
+        "--no-checkpoint",
+        help="do not continue an interrupted check and do not save the progress",
+        default=False,
+        action='store_true')
+    group = group.add_mutually_exclusive_group()
+    group.add_argument(
+        "--sample-bytes",
+        help="check only the files of all backups that were not verified "
+             "for the longest time, up to SIZE bytes (e.g. 20G)",
+        metavar='SIZE')
+    group.add_argument(
+        "--sample-fraction",
+        help="like --sample-bytes, with a fraction of the size of all files "
+             "(e.g. 0.05)",
+        metavar='F',
+        type=float)
     Restore.populate_arguments(parser)
     parser.set_defaults(func=action_integrity)
 
@@ -142,6 +408,7 @@ def update_argparse(subparsers):
                     'the current files are checked.',
         help='show changed files compared to backup or now')
     parser.add_argument('TIMESPEC2', help='specify other backup or "now" for current files')
+    parser.add_argument('PATH', nargs='*', help='only compare these directories')
     group = parser.add_argument_group('Display Options')
     group.add_argument(
         "-l", "--long",
@@ -154,4 +421,5 @@ def update_argparse(subparsers):
         default=False,
         action='store_true')
     Restore.populate_arguments(parser)
+    Create.populate_arguments(parser)
     parser.set_defaults(func=action_changes)
@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# (C) 2012-2016 Chris Liechti <cliechti@gmx.net>
+#
+# SPDX-License-Identifier:    BSD-3-Clause
+"""\
+Link To The Past - a backup tool
+
+Copy the contents of files.
+
+When no hash has to be calculated, the data does not need to be seen by
+this program and the copy is done by the kernel (copy_file_range, sendfile).
+Otherwise (or if the kernel or file system does not support it) the data
+is copied in blocks. Large files are copied by a pipeline: reading,
+hashing and writing run in different threads (hashlib and zlib release the
+GIL for large buffers) and work on a ring of reused buffers. This only helps
+when writing blocks, i.e. when the data no longer fits the page cache (see
+test/test_copier.py: 1.1-1.7 times faster writing to a simulated disk of
+300MB/s, 5-30% slower when everything is cached), so it is only used for
+files of at least PIPELINE_MIN_SIZE.
+
+Sparse files (less space allocated than their size) are copied segment by
+segment, holes are skipped (SEEK_DATA/SEEK_HOLE) and stay holes in the copy.
+The hash is calculated as if the holes were read, so it is the same as for
+a dense copy. The segments are read with pread on the file descriptor, as
+SEEK_DATA/SEEK_HOLE move its position behind the back of a buffered file
+object.
+"""
+import errno
+import hashlib
+import logging
+import os
+import queue
+import threading
+import zlib
+
+from . import hashes
+
+BLOCKSIZE = 1024 * 256   # 256kB
+
+# number of buffers used by the pipeline
+PIPELINE_BUFFERS = 4
+
+# smaller files are copied without threads, their writes usually end in the
+# page cache
+PIPELINE_MIN_SIZE = 1024 * 1024 * 64
+
+# number and size of the blocks read for a fingerprint, in addition to the
+# first and last block
+FINGERPRINT_BLOCKS = 8
+FINGERPRINT_BLOCK_SIZE = 1024 * 64
+
+# amount of data per system call when the kernel is copying
+ZERO_COPY_CHUNK = 1024 * 1024 * 1024
+
+# errors of copy_file_range/sendfile that mean "not supported here"
+UNSUPPORTED = {errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF}
+
+
+def copy_blocks(f_src, f_dst, h, blocksize=BLOCKSIZE):
+    """Copy from the current position to the end, updating the hash object h"""
+    buffer = bytearray(blocksize)
+    view = memoryview(buffer)
+    while True:
+        n = f_src.readinto(buffer)
+        if not n:
+            break
+        h.update(view[:n])
+        f_dst.write(view[:n])
+
+
+class _Stage(threading.Thread):
+    """\
+    A thread of the pipeline: applies function to the buffers from the input
+    queue and passes them on. After an error, the buffers are only passed
+    on, so that the other stages do not get stuck. None ends the thread.
+    """
+
+    def __init__(self, function, input, output):
+        super().__init__(name=function.__name__)
+        self.function = function
+        self.input = input
+        self.output = output
+        self.error = None
+
+    def run(self):
+        while True:
+            item = self.input.get()
+            if item is not None and self.error is None:
+                buffer, n = item
+                try:
+                    self.function(memoryview(buffer)[:n])
+                except Exception as e:
+                    self.error = e
+            self.output.put(item)
+            if item is None:
+                break
+
+
+def copy_pipelined(f_src, f_dst, h, blocksize=BLOCKSIZE, buffers=PIPELINE_BUFFERS):
+    """\
+    Same as copy_blocks, but hashing and writing run in threads. The data is
+    read into a fixed set of buffers that are handed from stage to stage and
+    back to the reader.
+    """
+    free = queue.Queue()
+    for i in range(buffers):
+        free.put((bytearray(blocksize), 0))
+    to_hash = queue.Queue()
+    to_write = queue.Queue()
+    hasher = _Stage(h.update, to_hash, to_write)
+    writer = _Stage(f_dst.write, to_write, free)
+    hasher.start()
+    writer.start()
+    try:
+        while hasher.error is None and writer.error is None:
+            buffer, n = free.get()
+            n = f_src.readinto(buffer)
+            if not n:
+                break
+            to_hash.put((buffer, n))
+    finally:
+        to_hash.put(None)
+        hasher.join()
+        writer.join()
+    for stage in (hasher, writer):
+        if stage.error is not None:
+            raise stage.error
+
+
+def is_sparse(fd, stat_now):
+    """\
+    Check if a file has holes: less space allocated than its size (which is
+    also the case for compressed files, e.g. on ZFS or btrfs) and a hole
+    before the end of the file. The file position is set to the start.
+    """
+    if not (hasattr(stat_now, 'st_blocks') and stat_now.st_blocks * 512 < stat_now.st_size):
+        return False
+    if not hasattr(os, 'SEEK_HOLE'):
+        return False    # can not find the holes anyway (see data_segments)
+    try:
+        return os.lseek(fd, 0, os.SEEK_HOLE) < stat_now.st_size
+    except OSError:
+        return False
+    finally:
+        os.lseek(fd, 0, os.SEEK_SET)
+
+
+def data_segments(fd, size):
+    """\
+    Generator yielding (start, end) of the parts of a file that contain data,
+    the rest are holes. If the system can not tell, the whole file is one
+    segment.
+    """
+    if not hasattr(os, 'SEEK_DATA'):
+        yield 0, size
+        return
+    position = 0
+    while position < size:
+        try:
+            start = os.lseek(fd, position, os.SEEK_DATA)
+        except OSError as e:
+            if e.errno == errno.ENXIO:
+                # no more data, hole up to the end
+                return
+            if position == 0:
+                yield 0, size
+                return
+            raise
+        end = os.lseek(fd, start, os.SEEK_HOLE)
+        yield start, min(end, size)
+        position = end
+
+
+def hash_zeros(h, length, zeros):
+    """Update the hash object h with length zero bytes, zeros is a buffer with zeros"""
+    while length > 0:
+        n = min(length, len(zeros))
+        h.update(zeros[:n])
+        length -= n
+
+
+def read_range(fd, start, end, blocksize=BLOCKSIZE):
+    """\
+    Generator yielding the bytes from start to end of a file descriptor in
+    blocks. Uses pread, the position of the file descriptor is not used.
+    """
+    position = start
+    while position < end:
+        data = os.pread(fd, min(end - position, blocksize), position)
+        if not data:
+            break
+        yield data
+        position += len(data)
+
+
+def copy_range(f_src, f_dst, h, start, end, blocksize=BLOCKSIZE):
+    """Copy the bytes from start to end, updating the hash object h"""
+    f_dst.seek(start)
+    for data in read_range(f_src.fileno(), start, end, blocksize):
+        h.update(data)
+        f_dst.write(data)
+
+
+def copy_sparse(f_src, f_dst, h, blocksize=BLOCKSIZE):
+    """\
+    Copy only the data segments of a file, the holes are hashed as zeros
+    but not written, so that the copy is sparse too.
+    """
+    size = os.fstat(f_src.fileno()).st_size
+    zeros = memoryview(bytes(blocksize))
+    position = 0
+    for start, end in data_segments(f_src.fileno(), size):
+        hash_zeros(h, start - position, zeros)
+        copy_range(f_src, f_dst, h, start, end, blocksize)
+        position = end
+    hash_zeros(h, size - position, zeros)
+    # the size includes a hole at the end
+    f_dst.truncate(size)
+
+
+def hash_file(path, hash_factory, blocksize=BLOCKSIZE):
+    """\
+    Calculate the hash over the contents of a file (or link target), return
+    the hex digest. Holes of sparse files are not read.
+    """
+    h = hash_factory()
+    if hash_factory is hashes.NoHash:
+        pass    # nothing to read
+    elif os.path.islink(path):
+        h.update(os.readlink(path).encode('utf-8'))
+    else:
+        buffer = bytearray(blocksize)
+        view = memoryview(buffer)
+        with open(path, 'rb') as f_src:
+            stat_now = os.fstat(f_src.fileno())
+            if is_sparse(f_src.fileno(), stat_now):
+                zeros = memoryview(bytes(blocksize))
+                position = 0
+                for start, end in data_segments(f_src.fileno(), stat_now.st_size):
+                    hash_zeros(h, start - position, zeros)
+                    for data in read_range(f_src.fileno(), start, end, blocksize):
+                        h.update(data)
+                    position = end
+                hash_zeros(h, stat_now.st_size - position, zeros)
+            else:
+                while True:
+                    n = f_src.readinto(buffer)
+                    if not n:
+                        break
+                    h.update(view[:n])
+    return h.hexdigest()
+
+
+def fingerprint_offsets(size, block_size=FINGERPRINT_BLOCK_SIZE, count=FINGERPRINT_BLOCKS):
+    """\
+    Offsets of the blocks read for a fingerprint: the first and the last
+    block and count blocks in between, chosen by the size, so that files of
+    the same size are compared at the same places. Small files are read
+    completely.
+
+    >>> fingerprint_offsets(25, 10, 2)
+    [0, 10, 20]
+    >>> fingerprint_offsets(1000, 10, 2)
+    [0, 470, 890, 990]
+    """
+    blocks = (size + block_size - 1) // block_size
+    if blocks <= count + 2:
+        return [n * block_size for n in range(blocks)]
+    middle = set()
+    for n in range(count):
+        middle.add(1 + zlib.crc32('{} {}'.format(size, n).encode('ascii')) % (blocks - 2))
+    return [0] + [n * block_size for n in sorted(middle)] + [size - block_size]
+
+
+def fingerprint_file(path, block_size=FINGERPRINT_BLOCK_SIZE):
+    """\
+    Hash of the size and some blocks of a file (see fingerprint_offsets).
+    Only modifications of these blocks are detected, for large files this
+    is a spot check.
+    """
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        h.update('{}\n'.format(size).encode('ascii'))
+        for offset in fingerprint_offsets(size, block_size):
+            f.seek(offset)
+            h.update(f.read(block_size))
+    return h.hexdigest()[:32]
+
+
+def _kernel_copy(function, src, dst, offset):
+    """\
+    Call function(src, dst, offset, count) until it returns 0 (end of file).
+    Returns the new offset. Raises OSError, with the offset reached as
+    attribute.
+    """
+    try:
+        while True:
+            n = function(src, dst, offset, ZERO_COPY_CHUNK)
+            if not n:
+                return offset
+            offset += n
+    except OSError as e:
+        e.offset = offset
+        raise
+
+
+def _copy_file_range(src, dst, offset, count):
+    return os.copy_file_range(src, dst, count, offset, offset)
+
+
+def _sendfile(src, dst, offset, count):
+    # writes at the current position of dst
+    os.lseek(dst, offset, os.SEEK_SET)
+    return os.sendfile(dst, src, offset, count)
+
+
+KERNEL_COPY_FUNCTIONS = []
+if hasattr(os, 'copy_file_range'):
+    KERNEL_COPY_FUNCTIONS.append(_copy_file_range)
+if hasattr(os, 'sendfile'):
+    KERNEL_COPY_FUNCTIONS.append(_sendfile)
+
+
+def copy_zero(f_src, f_dst, blocksize=BLOCKSIZE):
+    """\
+    Copy a file without passing the data through user space. Falls back to
+    sendfile and finally to copy_blocks, continuing where the previous
+    method stopped.
+    """
+    src = f_src.fileno()
+    dst = f_dst.fileno()
+    size = os.fstat(src).st_size
+    offset = 0
+    for function in KERNEL_COPY_FUNCTIONS:
+        try:
+            offset = _kernel_copy(function, src, dst, offset)
+        except OSError as e:
+            if e.errno not in UNSUPPORTED:
+                raise
+            logging.debug('{} not supported: {}'.format(function.__name__, e))
+            offset = e.offset
+        else:
+            # some file systems report end of file right away, do not trust
+            # that if the file is not empty
+            if offset > 0 or size == 0:
+                return
+    f_src.seek(offset)
+    f_dst.seek(offset)
+    copy_blocks(f_src, f_dst, hashes.NoHash(), blocksize)
+
+
+def copy_file(src, dst, hash_factory, blocksize=BLOCKSIZE):
+    """\
+    Create a copy of a file (or symbolic link), return the hex digest of the
+    hash over the contents (or link target).
+    """
+    h = hash_factory()
+    if os.path.islink(src):
+        linkto = os.readlink(src)
+        h.update(linkto.encode('utf-8'))
+        os.symlink(linkto, dst)
+    else:
+        with open(src, 'rb') as f_src:
+            with open(dst, 'wb') as f_dst:
+                stat_now = os.fstat(f_src.fileno())
+                if is_sparse(f_src.fileno(), stat_now):
+                    copy_sparse(f_src, f_dst, h, blocksize)
+                elif hash_factory is hashes.NoHash:
+                    copy_zero(f_src, f_dst, blocksize)
+                elif stat_now.st_size >= PIPELINE_MIN_SIZE:
+                    copy_pipelined(f_src, f_dst, h, blocksize)
+                else:
+                    copy_blocks(f_src, f_dst, h, blocksize)
+    return h.hexdigest()
@@ -7,16 +7,22 @@
 """\
 Link To The Past - a backup tool
 """
+import concurrent.futures
 import logging
 import os
+import queue
+import shutil
 import stat
 import sys
+import threading
 import time
 
-from . import filelist, indexer
+from . import copier, dedup, filelist, hash_cache, hashes, indexer
 from .backup import Backup
 from .error import BackupException
+from .journal import Journal
 from .speaking import nice_bytes
+from .string_escape import escaped
 
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
@@ -25,6 +31,50 @@ def len_iter(iterator):
     return sum(1 for i in iterator)
 
 
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+class CopyWorkers(object):
+    """\
+    Hand the entries of a backup to a function (copy/link) that is run by a
+    pool of threads. Entries must be put in the order of the tree.
+    Directories are processed right away in the calling thread, so that they
+    exist before their contents. The number of waiting files is limited.
+    With threads <= 1, everything is done in the calling thread.
+    """
+
+    def __init__(self, function, threads=1):
+        self.function = function
+        self.threads = threads
+        self.executor = None
+        self.pending = set()
+
+    def __enter__(self):
+        if self.threads > 1:
+            self.executor = concurrent.futures.ThreadPoolExecutor(self.threads)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.executor is not None:
+            self.wait(0)
+            self.executor.shutdown()
+
+    def wait(self, limit):
+        """Wait until at most limit files are pending"""
+        while len(self.pending) > limit:
+            done, self.pending = concurrent.futures.wait(
+                self.pending,
+                return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                future.result()
+
+    def put(self, entry):
+        """Process an entry"""
+        if self.executor is None or isinstance(entry, filelist.BackupDirectory):
+            self.function(entry)
+        else:
+            self.wait(4 * self.threads)
+            self.pending.add(self.executor.submit(self.function, entry))
+
+
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 class Create(Backup):
     """Common backup description."""
@@ -34,7 +84,40 @@ class Create(Backup):
         self.backup_root = filelist.FileList()  # previous backup
         self.bytes_required = 0
         self.files_changed = 0
+        self.files_forced = 0   # unchanged files, copied because of force_copy
+        self.bytes_copied = 0
+        self.entries_created = 0
+        self.counter_lock = threading.Lock()
+        self.copy_threads = 1
+        # hard link files that were moved (same inode, size and mtime)
+        self.detect_moves = True
+        self.moved = {}     # path -> path in previous backup
+        self.inodes = None
+        # hard link files with the same contents (see dedup)
+        self.deduplicate = False
+        self.hash_pool = None
         self.indexer = indexer.Indexer(self.source_root)
+        # scan, compare and copy at the same time
+        self.streaming = False
+        self.queue_size = 100   # max. number of directories waiting in each stage
+        # keep directory listings in the target (see indexer.ScanCache)
+        self.scan_cache = False
+        self.journal_mark = None    # see prepare_journal
+
+    def load_configuration(self, filename):
+        Backup.load_configuration(self, filename)
+        # the configuration may select an other type of file list
+        self.source_root = self.indexer.root = self.new_file_list()
+        self.backup_root = self.new_file_list()
+        self.source_root.policy = self.policy
+        if self.hash_cache:
+            self.source_root.hash_cache = hash_cache.HashCache(os.path.join(self.target_path, 'hash_cache'))
+            self.source_root.hash_cache.load()
+        self.source_root.change_detection = self.change_detection
+        # source files may be hashed before the backup is made (see same_contents)
+        self.source_root.set_hash(self.hash_name)
+        if self.scan_cache:
+            self.indexer.scan_cache_file = os.path.join(self.target_path, 'scan_cache')
 
     def load_backup_file_list(self):
         self.backup_root.load(os.path.join(self.last_backup_path, 'file_list'))
@@ -48,16 +131,40 @@ class Create(Backup):
         os.mkdir(self.current_backup_path)
         self.source_root.root = self.current_backup_path
         self.source_root.set_hash(self.hash_name)
+        self.source_root.file_format = self.file_list_format
 
     def finalize_target(self):
         """Complete the backup"""
-        # write file list
-        self.source_root.save(os.path.join(self.current_backup_path, 'file_list'))
+        # write file list, with an index for fast lookups when restoring
+        self.source_root.save(os.path.join(self.current_backup_path, 'file_list'), index=True)
+        if self.journal_mark is not None:
+            Journal.save_mark(self.current_backup_path, self.journal_mark)
         # make backup itself read-only
         os.chmod(self.current_backup_path, stat.S_IRUSR | stat.S_IXUSR | stat.S_IRGRP | stat.S_IXGRP)
         # remove the '_incomplete' suffix
         os.rename(self.current_backup_path, self.base_name)
 
+    def prepare_journal(self):
+        """\
+        If the watch action keeps a journal in the target, use it to read
+        only the directories that changed since the last backup. A new mark
+        is added to the journal for the next backup.
+        """
+        self.journal_mark = None
+        journal = Journal(self.target_path, self.indexer.filter_checksum())
+        if not journal.exists():
+            return
+        if self.last_backup_path is not None and not self.indexer.strict_scan:
+            token = journal.read_mark(self.last_backup_path)
+            changes = journal.changes_since(token) if token is not None else None
+            if changes is not None:
+                logging.info('Watch journal lists {} changed directories'.format(len(changes)))
+                self.indexer.changes = changes
+                self.indexer.reference = self.backup_root
+            else:
+                logging.info('Watch journal can not be used, scanning all directories')
+        self.journal_mark = journal.add_mark()
+
     def scan_last_backup(self):
         """Find all files in the last backup"""
         # first (or forced) -> full copy
@@ -67,18 +174,112 @@ class Create(Backup):
             logging.debug('Checking for changes')
             #~ self.source_root.print_listing()
             #~ self.backup_root.print_listing()
+            self.prepare_move_detection()
+            self.files_forced = 0
             for root, dirs, files in self.source_root.compare(self.backup_root):
-                for entry, other_entry in zip(files.same, files.same_other):
+                same = list(zip(files.same, files.same_other))
+                same.extend((entry, other_entry) for entry, other_entry in zip(files.changed, files.changed_other)
+                            if self.same_contents(entry, other_entry))
+                for entry, other_entry in same:
+                    if self.policy.force_copy_file(entry.path):
+                        self.files_forced += 1
+                        continue
+                    if not self.same_fingerprint(entry, other_entry):
+                        continue
                     entry.changed = False
                     entry.data_hash = other_entry.data_hash
+                if self.inodes is not None:
+                    for entry in files.added + files.changed:
+                        if entry.changed:
+                            self.check_moved(entry)
         # count bytes and files to backup
         self.bytes_required = 0
         self.files_changed = 0
         for path, dirs, files in self.source_root.walk():
             for entry in files:
                 if entry.changed:
-                    self.bytes_required += entry.stat.size
+                    self.bytes_required += entry.stat.disk_usage
                     self.files_changed += 1
+                    if entry.fingerprint is None:
+                        self.update_fingerprint(entry)
+
+    def same_contents(self, entry, other_entry):
+        """\
+        With change_detection ctime, a file where only the change time or
+        inode differs from the previous backup is read: if the hash is the
+        same, it is unchanged (e.g. only links or attributes were changed),
+        else it was modified with the modification time set back.
+        """
+        if (self.change_detection != 'ctime' or
+                isinstance(other_entry, filelist.BackupDirectory) or
+                other_entry.data_hash == '-' or
+                other_entry.filelist.hash_name != entry.filelist.hash_name or
+                not stat.S_ISREG(entry.stat.mode) or
+                not entry.same_meta_data(other_entry)):
+            return False
+        try:
+            entry.update_hash_from_source()
+        except OSError as e:
+            logging.warning('can not read {}: {}'.format(escaped(entry.path), e))
+            return False
+        if entry.data_hash != other_entry.data_hash:
+            logging.info('modified, with the same modification time: {}'.format(escaped(entry.path)))
+            return False
+        return True
+
+    def update_fingerprint(self, entry):
+        """Calculate the fingerprint of a source file, if the policy selects it"""
+        if stat.S_ISREG(entry.stat.mode) and self.policy.fingerprint_file(entry.path):
+            try:
+                entry.fingerprint = copier.fingerprint_file(entry.source_path)
+            except OSError as e:
+                logging.warning('can not read {}: {}'.format(escaped(entry.path), e))
+
+    def same_fingerprint(self, entry, other_entry):
+        """\
+        Compare the fingerprint of an unchanged file (same size and
+        modification time) with the previous backup, if the policy selects
+        the file. The file is modified if they differ.
+        """
+        self.update_fingerprint(entry)
+        if (entry.fingerprint is not None and other_entry.fingerprint is not None and
+                entry.fingerprint != other_entry.fingerprint):
+            logging.info('modified, fingerprint differs: {}'.format(escaped(entry.path)))
+            return False
+        return True
+
+    def prepare_move_detection(self):
+        """Map (device, inode) to the files of the previous backup"""
+        self.moved = {}
+        self.inodes = None
+        if not self.detect_moves:
+            return
+        self.inodes = {}
+        for path, dirs, files in self.backup_root.walk():
+            for entry in files:
+                if entry.stat.ino is not None:
+                    self.inodes[(entry.stat.dev, entry.stat.ino)] = entry
+
+    def check_moved(self, entry):
+        """\
+        Check if a new or changed file was in the previous backup under an
+        other name: same inode, size and modification time. It is then
+        marked as unchanged and linked to the old file.
+        """
+        other_entry = self.inodes.get((entry.stat.dev, entry.stat.ino))
+        if (other_entry is not None and
+                other_entry.path != entry.path and
+                not self.policy.force_copy_file(entry.path) and
+                entry.stat.mode == other_entry.stat.mode and
+                entry.stat.size == other_entry.stat.size and
+                abs(entry.stat.mtime - other_entry.stat.mtime) <= 0.00001):  # 10us; as it is a float...
+            logging.debug('moved {} -> {}'.format(escaped(other_entry.path), escaped(entry.path)))
+            entry.changed = False
+            entry.data_hash = other_entry.data_hash
+            entry.fingerprint = other_entry.fingerprint
+            self.moved[entry.path] = other_entry.path
+            return True
+        return False
 
     def check_target(self):
         """Verify that the target is suitable for the backup"""
@@ -94,20 +295,106 @@ class Create(Backup):
         if t.f_favail < len_iter(self.source_root.flattened()):
             raise BackupException('target file system will not allow to create that many files and directories')
 
+    def backup_entry(self, p):
+        """\
+        Copy or link one entry to the backup, errors are logged. This may
+        be run by CopyWorkers threads.
+        """
+        try:
+            if p.path in self.moved:
+                self.link_moved(p)
+            elif (self.hash_pool is not None and p.changed and not isinstance(p, filelist.BackupDirectory) and
+                    not self.policy.force_copy_file(p.path)):
+                self.link_or_copy(p)
+            else:
+                p.create()
+        except Exception as e:
+            logging.exception('Error backing up {}: {}'.format(p, e))
+            #~ logging.error('Error backing up %s: %s' % (p, e))
+        with self.counter_lock:
+            if p.changed and not isinstance(p, filelist.BackupDirectory):
+                self.bytes_copied += p.stat.disk_usage
+            self.entries_created += 1
+
+    def link_moved(self, p):
+        """Hard link a moved file to the file in the previous backup"""
+        logging.debug('hard linking moved {}'.format(escaped(p.path)))
+        os.link(filelist.join(self.source_root.reference, self.moved[p.path]), p.backup_path)
+
+    def prepare_deduplication(self):
+        """Create the pool of known files, if deduplication is enabled"""
+        if not self.deduplicate:
+            return
+        if hashes.get_factory(self.hash_name) is hashes.NoHash:
+            logging.warning('deduplication needs a hash, it is not used')
+            return
+        self.hash_pool = dedup.HashPool(self.hash_name)
+        if self.last_backup_path is not None:
+            self.hash_pool.add_file_list(self.backup_root, self.last_backup_path)
+
+    def link_or_copy(self, p):
+        """\
+        Copy a new or changed file, unless a file with the same contents is
+        already in the backup (or the previous one), then that one is hard
+        linked. The file is only hashed first, if there is a file of the same
+        size.
+        """
+        if not stat.S_ISREG(p.stat.mode):
+            p.create()
+            return
+        size = p.stat.size
+        self.hash_pool.begin(size)
+        try:
+            if self.hash_pool.may_contain(size):
+                p.update_hash_from_source()
+                path = self.hash_pool.find(p.data_hash, size, p.source_path)
+                if path is not None:
+                    try:
+                        os.link(path, p.backup_path)
+                    except OSError as e:
+                        logging.warning('hard linking {} failed, copying it: {}'.format(escaped(p.path), e))
+                    else:
+                        logging.debug('deduplicated {}'.format(escaped(p.path)))
+                        self.hash_pool.linked(p.stat.disk_usage)
+                        return
+            p.create()
+            self.hash_pool.add(p.data_hash, size, p.backup_path)
+        finally:
+            self.hash_pool.end(size)
+
+    def secure_entries(self):
+        """Make the directories in the backup read-only too"""
+        logging.debug('Making directories read-only')
+        for p in self.source_root.flattened():
+            try:
+                p.secure_backup()
+            except Exception as e:
+                logging.error('Error securing {}: {}'.format(p, e))
+
     def create(self, force=False, full_backup=False, dry_run=True, confirm=False):
         """Create a backup"""
-        # find files to backup
-        self.indexer.scan()
+        if self.streaming and not (dry_run or confirm):
+            self.create_streaming(force, full_backup)
+            return
         # find latest backup to work incrementally
         if not full_backup:
             self.find_latest_backup()
             if self.last_backup_path is not None:
                 self.load_backup_file_list()
                 self.source_root.reference = self.last_backup_path
+        # find files to backup
+        self.prepare_journal()
+        self.indexer.scan()
         self.scan_last_backup()
-        if not self.files_changed and not force:
+        if not dry_run:
+            self.prepare_deduplication()
+        if self.files_changed == self.files_forced and not self.moved and not force:
             raise BackupException('No changes detected, no need to backup')
         logging.info('Need to copy {} in {} files'.format(nice_bytes(self.bytes_required), self.files_changed))
+        if self.moved:
+            logging.info('Found {} moved files'.format(len(self.moved)))
+        if self.files_forced:
+            logging.info('{} unchanged files are copied (force_copy)'.format(self.files_forced))
         if confirm:
             input('type ENTER to execute')
         # check target
@@ -119,42 +406,229 @@ class Create(Backup):
                     entry,))
         else:
             t_start = time.time()
-            bytes_copied = 0
+            self.bytes_copied = 0
             # backup files
             self.prepare_target()
             logging.debug('Copying/linking files')
-            for p in self.source_root.flattened():
-                try:
-                    p.create()
-                except Exception as e:
-                    logging.exception('Error backing up {}: {}'.format(p, e))
-                    #~ logging.error('Error backing up %s: %s' % (p, e))
-                if p.changed and not isinstance(p, filelist.BackupDirectory):
-                    bytes_copied += p.stat.size
-                # XXX make this optional
-                if self.bytes_required:
-                    sys.stderr.write('{:5.1f}%\r'.format((100.0 * bytes_copied / self.bytes_required)))
+            with CopyWorkers(self.backup_entry, self.copy_threads) as workers:
+                for p in self.source_root.flattened():
+                    workers.put(p)
+                    # XXX make this optional
+                    if self.bytes_required:
+                        sys.stderr.write('{:5.1f}%\r'.format((100.0 * self.bytes_copied / self.bytes_required)))
             # secure directories (make them read-only too)
-            logging.debug('Making directories read-only')
-            for p in self.source_root.flattened():
-                try:
-                    p.secure_backup()
-                except Exception as e:
-                    logging.error('Error securing {}: {}'.format(p, e))
+            self.secure_entries()
             self.finalize_target()
-            time_used = time.time() - t_start
-            logging.info('Copied {} in {:.1f} seconds = {}/s'.format(
-                nice_bytes(self.bytes_required),
-                time_used,
-                nice_bytes(self.bytes_required / time_used)))
-            logging.info('Created {}'.format(self.base_name))
+            self.log_summary(t_start)
+
+    def log_summary(self, t_start):
+        """Output statistics at the end of a backup"""
+        time_used = time.time() - t_start
+        logging.info('Copied {} in {:.1f} seconds = {}/s'.format(
+            nice_bytes(self.bytes_required),
+            time_used,
+            nice_bytes(self.bytes_required / time_used)))
+        if self.hash_pool is not None:
+            logging.info('Deduplication: linked {} files, saved {}'.format(
+                self.hash_pool.files_linked,
+                nice_bytes(self.hash_pool.bytes_saved)))
+        logging.info('Created {}'.format(self.base_name))
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    # streaming mode: the source is scanned in a thread, the entries are
+    # compared to the previous backup as they are found and copied/linked by
+    # an other thread. The stages are connected by bounded queues with lists
+    # of entries (the contents of a directory), directories are always passed
+    # on before their contents.
+
+    def compare_entries(self, entries, references):
+        """\
+        Streaming equivalent of scan_last_backup for a list of new entries.
+        references maps the paths of source directories to the entries of
+        the directory in the previous backup (a dict, None if the directory
+        is not in the previous backup).
+        """
+        for entry in entries:
+            reference = references.get(entry.parent.path)
+            other_entry = reference.get(entry.name) if reference is not None else None
+            if isinstance(entry, filelist.BackupDirectory):
+                if isinstance(other_entry, filelist.BackupDirectory):
+                    references[entry.path] = other_entry.entries
+                else:
+                    references[entry.path] = None
+            elif (other_entry is not None and not isinstance(other_entry, filelist.BackupDirectory) and
+                    (entry == other_entry or self.same_contents(entry, other_entry))):
+                if self.policy.force_copy_file(entry.path):
+                    self.files_forced += 1
+                    self.bytes_required += entry.stat.disk_usage
+                    self.files_changed += 1
+                    self.update_fingerprint(entry)
+                elif not self.same_fingerprint(entry, other_entry):
+                    self.bytes_required += entry.stat.disk_usage
+                    self.files_changed += 1
+                else:
+                    entry.changed = False
+                    entry.data_hash = other_entry.data_hash
+            elif self.inodes is not None and self.check_moved(entry):
+                pass
+            else:
+                self.bytes_required += entry.stat.disk_usage
+                self.files_changed += 1
+                self.update_fingerprint(entry)
+
+    def reserve(self, entries):
+        """\
+        Streaming equivalent of check_target. Ensure that the space and the
+        number of inodes that are needed for the new entries and all entries
+        that are waiting to be copied are available on the target. Raises
+        BackupException otherwise.
+        """
+        self.bytes_reserved += sum(entry.stat.disk_usage for entry in entries
+                                   if entry.changed and not isinstance(entry, filelist.BackupDirectory))
+        self.entries_reserved += len(entries)
+        # the counters of the copy thread are only read here. a file that is
+        # being copied is counted twice, that is on the safe side
+        bytes_pending = self.bytes_reserved - self.bytes_copied
+        entries_pending = self.entries_reserved - self.entries_created
+        t = os.statvfs(self.target_path)
+        bytes_free = t.f_bsize * t.f_bavail
+        if bytes_free < bytes_pending:
+            raise BackupException('not enough free space on target {} available but {} required'.format(
+                nice_bytes(bytes_free),
+                nice_bytes(bytes_pending)))
+        if t.f_favail < entries_pending:
+            raise BackupException('target file system will not allow to create that many files and directories')
+
+    def _scan_worker(self, scanned, abort):
+        """Thread scanning the source, new entries are put into the queue"""
+        def added(entries):
+            if abort.is_set():
+                raise BackupException('scan aborted')
+            scanned.put(entries)
+        self.indexer.on_added = added
+        try:
+            self.indexer.scan()
+        except Exception as e:
+            scanned.put(e)
+        else:
+            scanned.put(None)
+        finally:
+            self.indexer.on_added = None
+
+    def _copy_worker(self, to_copy, abort):
+        """Thread copying/linking the entries from the queue to the backup"""
+        with CopyWorkers(self.backup_entry, self.copy_threads) as workers:
+            while True:
+                entries = to_copy.get()
+                if entries is None:
+                    break
+                if abort.is_set():
+                    continue
+                for p in entries:
+                    workers.put(p)
+                # XXX make this optional
+                sys.stderr.write('{:>10}\r'.format(nice_bytes(self.bytes_copied)))
+
+    def create_streaming(self, force=False, full_backup=False):
+        """\
+        Create a backup, overlapping scanning, comparing and copying.
+        The free space is checked for each directory (see reserve). If no
+        changes are found, the new backup is removed again at the end.
+        """
+        t_start = time.time()
+        if not full_backup:
+            self.find_latest_backup()
+            if self.last_backup_path is not None:
+                self.load_backup_file_list()
+                self.source_root.reference = self.last_backup_path
+        else:
+            logging.info('No previous backup, create full copy of all items')
+        if self.last_backup_path is not None:
+            self.prepare_move_detection()
+        self.prepare_deduplication()
+        self.prepare_journal()
+        references = {self.source_root.path: self.backup_root.entries if self.last_backup_path is not None else None}
+        self.bytes_required = self.files_changed = self.files_forced = 0
+        self.bytes_reserved = self.entries_reserved = 0
+        self.bytes_copied = self.entries_created = 0
+        if not os.path.exists(self.target_path):
+            os.mkdir(self.target_path)
+        self.prepare_target()
+        scanned = queue.Queue(self.queue_size)
+        to_copy = queue.Queue(self.queue_size)
+        abort = threading.Event()
+        scanner = threading.Thread(target=self._scan_worker, args=(scanned, abort), name='scan')
+        copy_thread = threading.Thread(target=self._copy_worker, args=(to_copy, abort), name='copy')
+        logging.debug('Scanning and copying/linking files')
+        scanner.start()
+        copy_thread.start()
+        try:
+            while True:
+                entries = scanned.get()
+                if entries is None:
+                    break
+                if isinstance(entries, Exception):
+                    raise entries
+                self.compare_entries(entries, references)
+                self.reserve(entries)
+                to_copy.put(entries)
+        except:
+            abort.set()
+            # unblock the scanner, it stops on its next directory
+            while scanner.is_alive():
+                try:
+                    scanned.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            raise
+        finally:
+            to_copy.put(None)
+            copy_thread.join()
+            scanner.join()
+        if self.files_changed == self.files_forced and not self.moved and not force:
+            # directories are still writeable, so it can be removed
+            shutil.rmtree(self.current_backup_path)
+            raise BackupException('No changes detected, no need to backup')
+        self.secure_entries()
+        self.finalize_target()
+        self.log_summary(t_start)
+
+    @staticmethod
+    def populate_arguments(parser):
+        group = parser.add_argument_group('Scan Options')
+        group.add_argument(
+            "--scan-threads",
+            help="number of threads used to scan the source (default: 1 or as set in control file)",
+            metavar='N',
+            type=int,
+            default=None)
+        group.add_argument(
+            "--strict-scan",
+            help="read all directories, do not use the scan cache",
+            action='store_true',
+            default=False)
+
+    def evaluate_arguments(self, args):
+        super().evaluate_arguments(args)
+        if args.scan_threads is not None:
+            self.indexer.scan_threads = args.scan_threads
+        self.indexer.strict_scan = args.strict_scan
 
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 def action_create(args):
     b = Create()
     b.evaluate_arguments(args)
-    b.create(args.force, args.full, args.dry_run, args.confirm)
+    if args.streaming:
+        b.streaming = True
+    if args.copy_threads is not None:
+        b.copy_threads = args.copy_threads
+    try:
+        b.create(args.force, args.full, args.dry_run, args.confirm)
+    finally:
+        # the attributes were written, also if no backup was made
+        if b.source_root.hash_cache is not None:
+            b.source_root.hash_cache.save()
 
 
 def update_argparse(subparsers):
@@ -184,6 +658,18 @@ def update_argparse(subparsers):
         help="after scanning, wait for confirmation by user",
         default=False,
         action='store_true')
+    group.add_argument(
+        "--copy-threads",
+        help="number of threads used to copy/link files (default: 1 or as set in control file)",
+        metavar='N',
+        type=int,
+        default=None)
+    group.add_argument(
+        "--streaming",
+        help="copy files while the source is still scanned (not with --dry-run or --confirm)",
+        default=False,
+        action='store_true')
+    Create.populate_arguments(parser)
     parser.set_defaults(func=action_create)
 
 
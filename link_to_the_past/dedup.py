@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# (C) 2012-2016 Chris Liechti <cliechti@gmx.net>
+#
+# SPDX-License-Identifier:    BSD-3-Clause
+"""\
+Link To The Past - a backup tool
+
+Find files with the same contents, so that they can be hard linked.
+
+The pool knows the files of the previous backup and the files copied so
+far, by hash and size. Files are only hashed before copying if there is a
+file of the same size in the pool.
+
+With hashes that are not collision resistant (CRC32, MD5), the contents are
+compared byte by byte before a file is linked.
+
+With several copy threads, files of the same size are handled one after the
+other (see begin and end), so that a copy that is in progress is found by
+the next file with the same contents.
+"""
+import filecmp
+import logging
+import os
+import stat
+import threading
+
+from .filelist import join
+from .string_escape import escaped
+
+
+# hashes where equal hashes are trusted to mean equal contents
+COLLISION_RESISTANT = {'SHA-256', 'SHA-512'}
+
+
+class HashPool(object):
+    """Map the contents (hash and size) of files to a path in a backup"""
+
+    def __init__(self, hash_name):
+        self.hash_name = hash_name
+        self.compare_bytes = hash_name.upper() not in COLLISION_RESISTANT
+        self.files = {}     # (hash, size) -> path
+        self.sizes = set()
+        self.files_linked = 0
+        self.bytes_saved = 0
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+        self.busy_sizes = set()     # sizes of the files handled right now (see begin)
+
+    def begin(self, size):
+        """\
+        Wait until no other thread handles a file of that size, must be
+        followed by end(size) when the file is linked or copied.
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: size not in self.busy_sizes)
+            self.busy_sizes.add(size)
+
+    def end(self, size):
+        with self.condition:
+            self.busy_sizes.discard(size)
+            self.condition.notify_all()
+
+    def add(self, data_hash, size, path):
+        """Add a file, the first file with that contents is kept"""
+        if data_hash != '-' and size > 0:
+            self.files.setdefault((data_hash, size), path)
+            self.sizes.add(size)
+
+    def add_file_list(self, file_list, root):
+        """Add all files of a backup, root is the path of the backup"""
+        if file_list.hash_name != self.hash_name:
+            logging.info('Previous backup uses an other hash, not used for deduplication')
+            return
+        for path, dirs, files in file_list.walk():
+            for entry in files:
+                if stat.S_ISREG(entry.stat.mode):
+                    self.add(entry.data_hash, entry.stat.size, join(root, entry.path))
+
+    def may_contain(self, size):
+        """Check if a file of that size is known (without reading the file)"""
+        return size in self.sizes
+
+    def find(self, data_hash, size, source_path):
+        """\
+        Return the path of a file with that hash and size or None. The size
+        of the file on disk is checked too and, if the hash is not collision
+        resistant, its contents are compared with the file at source_path.
+        """
+        path = self.files.get((data_hash, size))
+        if path is not None:
+            try:
+                stat_now = os.lstat(path)
+            except OSError:
+                stat_now = None
+            if stat_now is None or not stat.S_ISREG(stat_now.st_mode) or stat_now.st_size != size:
+                logging.warning('not using {} for deduplication, it was modified'.format(escaped(path)))
+                with self.lock:
+                    self.files.pop((data_hash, size), None)
+                return None
+            if self.compare_bytes and not filecmp.cmp(source_path, path, shallow=False):
+                logging.info('same {} hash, but other contents: {}'.format(self.hash_name, escaped(source_path)))
+                return None
+        return path
+
+    def linked(self, size):
+        """Count a file that was linked instead of copied"""
+        with self.lock:
+            self.files_linked += 1
+            self.bytes_saved += size
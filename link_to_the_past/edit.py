@@ -51,8 +51,9 @@ class EditBackup(Restore):
 
     def write_file_list(self):
         """Write a new version of the file list"""
+        file_list = os.path.join(self.current_backup_path, 'file_list')
         with writeable(self.current_backup_path):
-            self.root.save(os.path.join(self.current_backup_path, 'file_list'))
+            self.root.save(file_list, index=os.path.exists(file_list + filelist.INDEX_SUFFIX))
 
     def rm(self, source, recursive=False, force=False):
         """\
@@ -23,11 +23,13 @@ Operations affecting the file system:
 import sys
 import os
 import codecs
+import mmap
 import time
 import stat
+import struct
 import logging
 
-from . import config_file_parser, hashes
+from . import config_file_parser, copier, hashes
 from .speaking import nice_bytes, mode_to_chars
 from .string_escape import escaped, unescape
 
@@ -37,6 +39,253 @@ def join(root, path):
     return os.path.normpath('{}{}{}'.format(root, os.sep, path))
 
 
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+# file list formats: 'p1' is the text format, 'p2' the binary one
+FILE_LIST_FORMATS = ('p1', 'p2')
+
+# the binary format starts with a header, followed by a description of the
+# record fields, the hash name, the records and the string table. records
+# have a fixed size, names and hashes are stored in the string table and
+# referenced by offset and length. records are in the order of
+# BackupDirectory.flattened so parents always come before their entries.
+P2_MAGIC = b'LTTP-p2\n'
+P2_VERSION = 1
+P2_HEADER = struct.Struct('<8sIIQII')  # magic, version, record size, count, len(fields), len(hash)
+P2_FIELDS = (
+    ('parent', 'I'),
+    ('name', 'Q'),
+    ('name_length', 'I'),
+    ('mode', 'I'),
+    ('uid', 'I'),
+    ('gid', 'I'),
+    ('flags', 'q'),
+    ('size', 'Q'),
+    ('atime', 'd'),
+    ('mtime', 'd'),
+    ('data_hash', 'Q'),
+    ('data_hash_length', 'I'),
+    ('dev', 'Q'),
+    ('ino', 'Q'),
+    ('ctime', 'd'),
+    ('fingerprint', 'Q'),
+    ('fingerprint_length', 'I'),
+)
+P2_NONE = 0xffffffff   # used for unknown uid/gid and as parent of top level entries
+P2_NONE64 = 0xffffffffffffffff   # used for unknown dev/ino
+
+# the index is stored next to the file list. it starts with a header
+# followed by the hash name, a table with one entry per path, sorted by the
+# (UTF-8 encoded) path and the paths themselves. the table entries point to
+# the path and to the position of the record in the file list.
+INDEX_SUFFIX = '.idx'
+INDEX_MAGIC = b'LTTP-ix\n'
+INDEX_VERSION = 1
+INDEX_HEADER = struct.Struct('<8sIQ2sI')   # magic, version, count, file list format, len(hash)
+INDEX_ENTRY = struct.Struct('<QIQ')        # offset of path, len(path), offset of record
+
+
+def parse_p1_line(line):
+    """\
+    Parse a line of a text file list. Returns a record tuple (path, mode,
+    uid, gid, size, atime, mtime, flags, data_hash, dev, ino, ctime,
+    fingerprint) or None if it is not a plain p1 line.
+
+    >>> parse_p1_line('p1 33188 0 0 5 1.5 2.5 - - /a\\\\ b\\\\x23')
+    ('/a b#', 33188, 0, 0, 5, 1.5, 2.5, None, '-', None, None, None, None)
+    >>> parse_p1_line('p1 33188 0 0 5 1.5 2.5 - - /a inode 2049 1234 ctime 3.5 fingerprint 12ab')
+    ('/a', 33188, 0, 0, 5, 1.5, 2.5, None, '-', 2049, 1234, 3.5, '12ab')
+    >>> parse_p1_line('hash CRC32') is None
+    True
+    """
+    if '\\ ' in line:
+        # ensure escaped spaces do not include a space "\ " -> "\x20"
+        line = line.replace('\\ ', '\\x20')
+    fields = line.split()
+    if len(fields) < 10 or fields[0] != 'p1':
+        return None
+    st_dev = st_ino = st_ctime = fingerprint = None
+    if len(fields) > 10:
+        # optional fields after the path
+        extra = fields[10:]
+        del fields[10:]
+        while extra:
+            if extra[0] == 'inode' and len(extra) >= 3:
+                st_dev = int(extra[1])
+                st_ino = int(extra[2])
+                del extra[:3]
+            elif extra[0] == 'ctime' and len(extra) >= 2:
+                st_ctime = float(extra[1])
+                del extra[:2]
+            elif extra[0] == 'fingerprint' and len(extra) >= 2:
+                fingerprint = extra[1]
+                del extra[:2]
+            else:
+                # unknown, let FileListParser handle it
+                return None
+    p1, st_mode, st_uid, st_gid, st_size, st_atime, st_mtime, st_flags, data_hash, path = fields
+    if '\\' in path:
+        if path.count('\\') == path.count('\\x20'):
+            # only spaces are escaped, no need for the regexp
+            path = path.replace('\\x20', ' ')
+        else:
+            path = unescape(path)
+    return (path,
+            int(st_mode),
+            int(st_uid),
+            int(st_gid),
+            int(st_size),
+            float(st_atime),
+            float(st_mtime),
+            int(st_flags) if st_flags != '-' else None,
+            data_hash,
+            st_dev,
+            st_ino,
+            st_ctime,
+            fingerprint)
+
+
+class P2Layout(object):
+    """The layout of the records of a binary file list, read from its header"""
+
+    def __init__(self, filename, data):
+        magic, version, record_size, count, fields_length, hash_length = P2_HEADER.unpack_from(data)
+        if magic != P2_MAGIC or version > P2_VERSION:
+            raise ValueError('file list {} has unsupported format or version'.format(filename))
+        position = P2_HEADER.size
+        fields = bytes(data[position:position + fields_length]).decode('ascii').split()
+        position += fields_length
+        hash_name = bytes(data[position:position + hash_length]).decode('utf-8')
+        position += hash_length
+        self.hash_name = hash_name if hash_name else None
+        # the record layout is described in the file, look up the columns by
+        # name so that fields can be added in the future
+        names = [field.split(':')[0] for field in fields]
+        self.record = struct.Struct('<' + ''.join(field.split(':')[1] for field in fields))
+        if self.record.size != record_size:
+            raise ValueError('file list {} is corrupted (record size)'.format(filename))
+        # fields that were added later may be missing in older files (None)
+        self.indexes = [names.index(name) if name in names else None for name, code in P2_FIELDS]
+        self.records = position
+        self.strings = position + record_size * count
+
+    def string(self, data, offset, length, encoding='utf-8'):
+        """Get a string from the string table"""
+        offset += self.strings
+        return str(data[offset:offset + length], encoding)
+
+    def name(self, data, r):
+        """Get the name of the entry from the unpacked record r"""
+        return self.string(data, r[self.indexes[1]], r[self.indexes[2]])
+
+    def to_record(self, data, path, r):
+        """Convert the unpacked record r to a record tuple for add_records"""
+        (i_parent, i_name, i_name_length, i_mode, i_uid, i_gid, i_flags, i_size,
+         i_atime, i_mtime, i_hash, i_hash_length, i_dev, i_ino, i_ctime,
+         i_fingerprint, i_fingerprint_length) = self.indexes
+        return (path,
+                r[i_mode],
+                r[i_uid] if r[i_uid] != P2_NONE else None,
+                r[i_gid] if r[i_gid] != P2_NONE else None,
+                r[i_size],
+                r[i_atime],
+                r[i_mtime],
+                r[i_flags] if r[i_flags] != -1 else None,
+                self.string(data, r[i_hash], r[i_hash_length], 'ascii'),
+                r[i_dev] if i_dev is not None and r[i_dev] != P2_NONE64 else None,
+                r[i_ino] if i_ino is not None and r[i_ino] != P2_NONE64 else None,
+                r[i_ctime] if i_ctime is not None and r[i_ctime] == r[i_ctime] else None,    # NaN: unknown
+                self.string(data, r[i_fingerprint], r[i_fingerprint_length], 'ascii')
+                if i_fingerprint is not None and r[i_fingerprint_length] else None)
+
+
+def write_index(filename, offsets, file_format, hash_name):
+    """\
+    Write an index for a file list. offsets is a list of tuples (path,
+    offset of record).
+    """
+    keys = sorted((path.encode('utf-8'), offset) for path, offset in offsets)
+    hash_name = (hash_name or '').encode('utf-8')
+    with open(filename, 'wb') as index:
+        index.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, len(keys), file_format.encode('ascii'), len(hash_name)))
+        index.write(hash_name)
+        position = 0
+        for key, offset in keys:
+            index.write(INDEX_ENTRY.pack(position, len(key), offset))
+            position += len(key)
+        for key, offset in keys:
+            index.write(key)
+    os.chmod(filename, stat.S_IRUSR | stat.S_IRGRP)
+
+
+class FileListIndex(object):
+    """\
+    Sorted index of the paths in a file list. Paths and directory contents
+    are found with a binary search, so that only the needed records of a
+    file list have to be read.
+    """
+
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.count, file_format, hash_length = INDEX_HEADER.unpack_from(self._data)
+        if magic != INDEX_MAGIC or version > INDEX_VERSION:
+            raise ValueError('index {} has unsupported format or version'.format(filename))
+        self.file_format = file_format.decode('ascii')
+        position = INDEX_HEADER.size
+        hash_name = self._data[position:position + hash_length].decode('utf-8')
+        self.hash_name = hash_name if hash_name else None
+        self._table = position + hash_length
+        self._keys = self._table + INDEX_ENTRY.size * self.count
+
+    def close(self):
+        self._data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _entry(self, n):
+        """Return path (encoded) and record offset of the n-th entry"""
+        key_offset, key_length, offset = INDEX_ENTRY.unpack_from(self._data, self._table + INDEX_ENTRY.size * n)
+        key_offset += self._keys
+        return self._data[key_offset:key_offset + key_length], offset
+
+    def _bisect(self, key):
+        """Return the position of the first entry that is not less than key"""
+        lo = 0
+        hi = self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._entry(mid)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def find(self, path):
+        """Return the record offset of given path or None"""
+        key = path.encode('utf-8')
+        n = self._bisect(key)
+        if n < self.count:
+            found, offset = self._entry(n)
+            if found == key:
+                return offset
+        return None
+
+    def iter_below(self, path):
+        """Generator yielding (path, record offset) for all entries below path"""
+        prefix = path.encode('utf-8')
+        if not prefix.endswith(os.sep.encode('utf-8')):
+            prefix += os.sep.encode('utf-8')
+        for n in range(self._bisect(prefix), self.count):
+            key, offset = self._entry(n)
+            if not key.startswith(prefix):
+                break
+            yield key.decode('utf-8'), offset
+
+
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 class CompareResult(object):
     """Store entry lists for compare operations."""
@@ -57,16 +306,20 @@ class CompareResult(object):
 class Stat(object):
     """Handle file meta data"""
 
-    __slots__ = ['size', 'mode', 'uid', 'gid', 'atime', 'mtime', 'flags']
+    __slots__ = ['size', 'mode', 'uid', 'gid', 'atime', 'mtime', 'ctime', 'flags', 'allocated', 'dev', 'ino']
 
     def __init__(self):
         self.size = 0
+        self.allocated = None   # bytes on disk, only known for scanned files (not saved)
         self.uid = None
         self.gid = None
         self.mode = None
         self.mtime = None
         self.atime = None
+        self.ctime = None
         self.flags = None
+        self.dev = None
+        self.ino = None
 
     def extract(self, stat_now):
         """\
@@ -76,16 +329,47 @@ class Stat(object):
             self.size = 0
         else:
             self.size = stat_now.st_size
+        if hasattr(stat_now, 'st_blocks'):
+            self.allocated = stat_now.st_blocks * 512
+        else:
+            self.allocated = None
         self.uid = stat_now.st_uid
         self.gid = stat_now.st_gid
         self.mode = stat_now.st_mode
         self.mtime = stat_now.st_mtime
         self.atime = stat_now.st_atime
+        self.ctime = stat_now.st_ctime
+        self.dev = stat_now.st_dev
+        self.ino = stat_now.st_ino
         if hasattr(stat_now, 'st_flags'):
             self.flags = stat_now.st_flags
         else:
             self.flags = None
 
+    def update(self, other):
+        """Copy all meta data from an other Stat"""
+        self.size = other.size
+        self.allocated = other.allocated
+        self.uid = other.uid
+        self.gid = other.gid
+        self.mode = other.mode
+        self.mtime = other.mtime
+        self.atime = other.atime
+        self.ctime = other.ctime
+        self.flags = other.flags
+        self.dev = other.dev
+        self.ino = other.ino
+
+    @property
+    def disk_usage(self):
+        """\
+        Number of bytes needed to store the data. This is less than the size
+        for sparse files.
+        """
+        if self.allocated is not None and self.allocated < self.size:
+            return self.allocated
+        return self.size
+
     def write(self, path, chmod_only=False):
         """\
         Apply all stat info (mode bits, atime, mtime, flags) to path.
@@ -93,8 +377,11 @@ class Stat(object):
         if not chmod_only:
             os.utime(path, (self.atime, self.mtime), follow_symlinks=False)
             os.chown(path, self.uid, self.gid, follow_symlinks=False)
-            os.chflags(path, self.flags, follow_symlinks=False)
-        os.chmod(path, self.mode, follow_symlinks=False)
+            if self.flags is not None and hasattr(os, 'chflags'):
+                os.chflags(path, self.flags, follow_symlinks=False)
+        # the mode of links can not be changed on all platforms (and is not used)
+        if not stat.S_ISLNK(self.mode):
+            os.chmod(path, self.mode)
 
     def make_read_only(self, path):
         """Use chmod to apply the modes with W bits cleared"""
@@ -108,7 +395,7 @@ class Stat(object):
 class BackupPath(object):
     """Representing an object that is contained in a backup"""
 
-    __slots__ = ['name', 'parent', '_path', 'filelist', 'changed', 'data_hash', 'stat']
+    __slots__ = ['name', 'parent', '_path', 'filelist', 'changed', 'data_hash', 'fingerprint', 'stat']
 
     def __init__(self, name=None, filelist=None, stat_now=None, parent=None):
         self.name = name
@@ -116,6 +403,7 @@ class BackupPath(object):
         self._path = None
         self.stat = Stat()
         self.data_hash = '-'
+        self.fingerprint = None     # see copier.fingerprint_file
         self.filelist = filelist
         if stat_now is not None:
             self.stat.extract(stat_now)
@@ -150,6 +438,22 @@ class BackupPath(object):
         return self.path < other.path
 
     def __eq__(self, other):
+        return self.same_meta_data(other, self.filelist.change_detection == 'ctime')
+
+    def same_meta_data(self, other, strict=False):
+        """\
+        Compare the meta data (and the hashes, if both are known). If strict
+        is true, a different change time or inode (where both are known)
+        makes the files different, these also change when a file is modified
+        and its modification time is set back.
+        """
+        if strict:
+            if self.stat.ino is not None and other.stat.ino is not None and self.stat.ino != other.stat.ino:
+                return False
+            if (self.stat.ctime is not None and other.stat.ctime is not None and
+                    abs(self.stat.ctime - other.stat.ctime) > 0.00001 and
+                    not self.same_cached_hash(other)):
+                return False
         same_hash = True    # if can't compare - ignore
         # hashes must be made using same algorithm and must be calculated (not '-')
         if self.filelist.hash_name == other.filelist.hash_name:
@@ -163,6 +467,22 @@ class BackupPath(object):
                 abs(self.stat.mtime - other.stat.mtime) <= 0.00001 and  # 10us; as it is a float...
                 self.stat.flags == other.stat.flags)
 
+    def same_cached_hash(self, other):
+        """\
+        Check if the hash cache (see hash_cache) has a valid hash of the
+        source file that is the same as the hash of other. Writing the cache
+        changes the change time of the file, but not its contents.
+        """
+        cache = self.filelist.hash_cache
+        if (cache is None or other.data_hash == '-' or
+                self.filelist.hash_name != other.filelist.hash_name):
+            return False
+        try:
+            stat_now = os.lstat(self.source_path)
+        except OSError:
+            return False
+        return cache.lookup(self.source_path, self.filelist.hash_name, stat_now) == other.data_hash
+
     def __str__(self):
         return '{} {:4} {:4} {:>7} {} {}'.format(
             mode_to_chars(self.stat.mode),
@@ -177,25 +497,31 @@ class BackupPath(object):
 
     @property
     def file_list_command(self):
-        return 'p1 {s.mode} {s.uid} {s.gid} {s.size} {s.atime:.9f} {s.mtime:.9f} {flags} {hash} {path}\n'.format(
+        return 'p1 {s.mode} {s.uid} {s.gid} {s.size} {s.atime:.9f} {s.mtime:.9f} {flags} {hash} {path}{extra}\n'.format(
             s=self.stat,
             flags=self.stat.flags if self.stat.flags is not None else '-',
             hash=self.data_hash,
-            path=escaped(self.path))
+            path=escaped(self.path),
+            extra='{}{}{}'.format(
+                ' inode {s.dev} {s.ino}'.format(s=self.stat) if self.stat.ino is not None else '',
+                ' ctime {s.ctime:.9f}'.format(s=self.stat) if self.stat.ctime is not None else '',
+                ' fingerprint {}'.format(self.fingerprint) if self.fingerprint is not None else ''))
 
 
 class BackupFile(BackupPath):
     """Information about a file as well as operations"""
 
-    BLOCKSIZE = 1024 * 256   # 256kB
-
     def cp(self, dst, permissions=True):
         """\
         Create a copy of the file (or link) to given destination. Permissions
         are restored if the flag is true.
         """
         logging.debug('copying {}'.format(escaped(self.path)))
-        hexdigest = self._copy_file(self.backup_path, dst)
+        if self.data_hash == '-':
+            # no hash recorded for this file, nothing to check
+            hexdigest = copier.copy_file(self.backup_path, dst, hashes.NoHash, self.filelist.block_size)
+        else:
+            hexdigest = self._copy_file(self.backup_path, dst)
         if permissions:
             self.stat.write(dst)
         if self.data_hash != hexdigest:
@@ -203,23 +529,17 @@ class BackupFile(BackupPath):
                           'but does not match the stored hash: '
                           '{} (expected: {} got: {})'.format(escaped(self.path), self.data_hash, hexdigest))
 
+    @property
+    def hash_factory(self):
+        """The hash for this file, the policy of the file list may turn it off"""
+        policy = self.filelist.policy
+        if policy is not None and not policy.checksum(self.path):
+            return hashes.NoHash
+        return self.filelist.hash_factory
+
     def _copy_file(self, src, dst):
         """Create a copy a file (or link)"""
-        h = self.filelist.hash_factory()
-        if os.path.islink(src):
-            linkto = os.readlink(src)
-            h.update(linkto.encode('utf-8'))
-            os.symlink(linkto, dst)
-        else:
-            with open(src, 'rb') as f_src:
-                with open(dst, 'wb') as f_dst:
-                    while True:
-                        block = f_src.read(self.BLOCKSIZE)
-                        if not block:
-                            break
-                        h.update(block)
-                        f_dst.write(block)
-        return h.hexdigest()
+        return copier.copy_file(src, dst, self.hash_factory, self.filelist.block_size)
 
     def _copy(self):
         """Create a copy of the file"""
@@ -258,26 +578,24 @@ class BackupFile(BackupPath):
         Calculate the hash of the file given as path. The hash value is
         returned.
         """
-        h = self.filelist.hash_factory()
-        if os.path.islink(path):
-            h.update(os.readlink(path).encode('utf-8'))
-        else:
-            with open(path, 'rb') as f_src:
-                while True:
-                    block = f_src.read(self.BLOCKSIZE)
-                    if not block:
-                        break
-                    h.update(block)
-        return h.hexdigest()
+        return copier.hash_file(path, self.hash_factory, self.filelist.block_size)
 
     def update_hash_from_source(self):
         """\
         Calculate the hash over source_path and set data_hash to the new value.
         Typically used to read in the hash of source files, e.g. for change
-        detection.
+        detection. With hash_cache set in the file list, the hash may be
+        taken from the cache (see hash_cache module).
         """
         logging.debug('calculating hash of {}'.format(escaped(self.source_path)))
-        self.data_hash = self._calculate_hash(self.source_path)
+        if self.filelist.hash_cache is not None and self.hash_factory is not hashes.NoHash:
+            cache = self.filelist.hash_cache
+            self.data_hash = cache.cached_hash(self.source_path, self.filelist.hash_name, self._calculate_hash)
+            # writing the cache changed the change time, it is not a change of the file
+            if self.stat.ctime is not None:
+                self.stat.ctime = cache.ctime_after_write(self.stat.dev, self.stat.ino, self.stat.ctime)
+        else:
+            self.data_hash = self._calculate_hash(self.source_path)
 
     def verify_hash(self, path):
         """\
@@ -346,7 +664,7 @@ class BackupDirectory(BackupPath):
                     entry.cp(os.path.join(dst, entry.name), permissions=permissions)
         if permissions:
             # set permission as last step in case a directory is made read-only
-            self.set_stat(dst)
+            self.stat.write(dst)
 
     def flattened(self, include_self=False):
         """Generator yielding all directories and files recursively"""
@@ -391,39 +709,50 @@ class BackupDirectory(BackupPath):
         #~ logging.debug('compare: %s' % (escaped(self.path),))
         files = CompareResult()
         dirs = CompareResult()
-        ref = list(other.entries.values())  # work on copy
-        for entry in self.entries.values():
-            for ref_entry in ref:
-                if entry.path == ref_entry.path:
-                    # XXX handle dirs that were files and vice versa
-                    if isinstance(entry, BackupDirectory):
-                        # dirs can not change
-                        dirs.same.append(entry)
-                    else:
-                        if entry == ref_entry:
-                            files.same.append(entry)
-                            files.same_other.append(ref_entry)
-                        else:
-                            files.changed.append(entry)
-                            files.changed_other.append(ref_entry)
-                    ref.remove(ref_entry)
-                    break
-            else:
+        # look up entries by name, linear in the number of entries
+        ref = other.entries
+        for name, entry in self.entries.items():
+            ref_entry = ref.get(name)
+            if ref_entry is None:
                 if isinstance(entry, BackupDirectory):
                     dirs.added.append(entry)
                 else:
                     files.added.append(entry)
-        # entries left in the ref list correspond to the items deleted in the source
-        for entry in ref:
-            if isinstance(entry, BackupDirectory):
-                dirs.removed.append(entry)
+            elif isinstance(entry, BackupDirectory):
+                if isinstance(ref_entry, BackupDirectory):
+                    # dirs can not change
+                    dirs.same.append(entry)
+                    dirs.same_other.append(ref_entry)
+                else:
+                    # file was replaced by a directory
+                    dirs.added.append(entry)
+                    files.removed.append(ref_entry)
+            elif isinstance(ref_entry, BackupDirectory):
+                # directory was replaced by a file, its contents are
+                # reported as removed below
+                files.added.append(entry)
+                dirs.removed.append(ref_entry)
             else:
-                files.removed.append(entry)
+                if entry == ref_entry:
+                    files.same.append(entry)
+                    files.same_other.append(ref_entry)
+                else:
+                    files.changed.append(entry)
+                    files.changed_other.append(ref_entry)
+        # entries that are not in this tree correspond to the items deleted
+        # in the source
+        entries = self.entries
+        for name, ref_entry in ref.items():
+            if name not in entries:
+                if isinstance(ref_entry, BackupDirectory):
+                    dirs.removed.append(ref_entry)
+                else:
+                    files.removed.append(ref_entry)
         yield (self.path, dirs, files)
         # have to go to the list once again as subdirs should be reported after
         # their parents, it can not be done in the loop above
-        for entry in dirs.same:
-            for x in entry.compare(other[entry.name]):
+        for entry, ref_entry in zip(dirs.same, dirs.same_other):
+            for x in entry.compare(ref_entry):
                 yield x
         # if exhaustive listing is requested, recursively report all items in
         # added or removed directories too
@@ -467,7 +796,7 @@ class BackupDirectory(BackupPath):
             sys.stdout.write('{}\n'.format(entry))
 
     def __iter__(self):
-        return self.entries.values()
+        return iter(self.entries.values())
 
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
@@ -480,21 +809,41 @@ class FileList(BackupDirectory):
         self.base_name = None
         self.hash_name = None
         self.hash_factory = None
+        self.file_format = 'p1'
+        self.block_size = copier.BLOCKSIZE   # used to read and write files
+        self.policy = None  # indexer.FilePolicy for the source, None: hash all
+        self.hash_cache = None      # hash_cache.HashCache for source files
+        self.change_detection = 'mtime'     # or 'ctime', see BackupPath.same_meta_data
 
     def set_hash(self, name):
-        if name is None:
-            self.hash_factory = None
-        else:
-            self.hash_factory = hashes.get_factory(name)
+        # without a name, NoHash is used
+        self.hash_factory = hashes.get_factory(name)
         self.hash_name = name
 
     def load(self, filename):
+        """Load a file list, the format is detected automatically"""
         logging.debug('Loading file list {}'.format(filename))
-        c = FileListParser(self)
-        c.load_file(filename, quick=True)
+        with open(filename, 'rb') as f:
+            magic = f.read(len(P2_MAGIC))
+        if magic == P2_MAGIC:
+            self._load_p2(filename)
+            self.file_format = 'p2'
+        else:
+            self._load_p1(filename)
+            self.file_format = 'p1'
 
-    def save(self, filename):
-        """Write a new version of the file list"""
+    def save(self, filename, file_format=None, index=False):
+        """\
+        Write a new version of the file list. The format defaults to the one
+        of the loaded list (or p1 for new lists). If index is true, a
+        FileListIndex is written too, an existing (old) index is removed in
+        any case.
+        """
+        if file_format is None:
+            file_format = self.file_format
+        if file_format not in FILE_LIST_FORMATS:
+            raise ValueError('unknown file list format: {!r}'.format(file_format))
+        offsets = [] if index else None
         # if file already exists, write to a new file and later remove old then
         # rename. this ensures that the list is not lost, even if the write
         # fails.
@@ -503,17 +852,226 @@ class FileList(BackupDirectory):
             filename = filename + '.new'
         else:
             rename = None  # XXX why not always use .new and rename?
-        with codecs.open(filename, 'w', 'utf-8') as file_list:
-            if self.hash_name is not None:
-                file_list.write('hash {}\n'.format(self.hash_name))
-            for p in self.flattened():
-                file_list.write(p.file_list_command)
+        if file_format == 'p2':
+            self._save_p2(filename, offsets)
+        else:
+            self._save_p1(filename, offsets)
         # make it read-only
         os.chmod(filename, stat.S_IRUSR | stat.S_IRGRP)
         if rename:
+            # the old index does not match the new list
+            if os.path.exists(rename + INDEX_SUFFIX):
+                os.remove(rename + INDEX_SUFFIX)
             # now remove old list and replace with new one
             os.remove(rename)
             os.rename(filename, rename)
+            filename = rename
+        if index:
+            write_index(filename + INDEX_SUFFIX, offsets, file_format, self.hash_name)
+
+    def _save_p1(self, filename, offsets=None):
+        """\
+        Write the text format. If offsets is a list, (path, position) tuples
+        are appended for each record.
+        """
+        with open(filename, 'wb') as file_list:
+            position = 0
+            if self.hash_name is not None:
+                line = 'hash {}\n'.format(self.hash_name).encode('utf-8')
+                file_list.write(line)
+                position += len(line)
+            for p in self.flattened():
+                line = p.file_list_command.encode('utf-8')
+                if offsets is not None:
+                    offsets.append((p.path, position))
+                file_list.write(line)
+                position += len(line)
+
+    def _load_p1(self, filename):
+        """Read the text format"""
+        self.add_records(self._read_p1(filename))
+
+    def _read_p1(self, filename):
+        """\
+        Generator yielding the records of a text file list. This is a fast
+        path for the ``p1`` lines as written by _save_p1: each line is split
+        once. All other lines (hash, comments, ...) are handed to
+        FileListParser.
+        """
+        parser = FileListParser(self)
+        parser.root = os.path.dirname(os.path.abspath(filename))
+        with open(filename, 'r', encoding='utf-8') as file_list:
+            for line in file_list:
+                record = parse_p1_line(line)
+                if record is not None:
+                    yield record
+                elif line.strip():
+                    parser.parse(config_file_parser.words_in_file_quick(filename, [line]))
+
+    def add_records(self, records):
+        """\
+        Add entries to the tree. records is an iterable of tuples (path,
+        mode, uid, gid, size, atime, mtime, flags, data_hash, dev, ino, ctime,
+        fingerprint) where
+        parent directories come before their contents, as in the file lists.
+        """
+        filelist = self
+        directories = {self.path: self}
+        last_parent_path = None
+        last_parent = None
+        S_ISDIR = stat.S_ISDIR
+        for (path, st_mode, st_uid, st_gid, st_size, st_atime, st_mtime, st_flags, data_hash,
+             st_dev, st_ino, st_ctime, fingerprint) in records:
+            if S_ISDIR(st_mode):
+                entry = BackupDirectory(filelist=filelist)
+                directories[path] = entry
+            else:
+                entry = BackupFile(filelist=filelist)
+            s = entry.stat
+            s.mode = st_mode
+            s.uid = st_uid
+            s.gid = st_gid
+            s.size = st_size
+            s.atime = st_atime
+            s.mtime = st_mtime
+            s.flags = st_flags
+            s.dev = st_dev
+            s.ino = st_ino
+            s.ctime = st_ctime
+            entry.data_hash = data_hash
+            entry.fingerprint = fingerprint
+            entry._path = path
+            parent_path, sep, entry.name = path.rpartition(os.sep)
+            if not parent_path:
+                parent_path = os.sep
+            if parent_path != last_parent_path:
+                # cache last parent to speed up
+                last_parent = directories.get(parent_path)
+                if last_parent is None:
+                    last_parent = self[parent_path]
+                last_parent_path = parent_path
+            entry.parent = last_parent
+            last_parent.entries[entry.name] = entry
+
+    def _save_p2(self, filename, offsets=None):
+        """\
+        Write the binary format. If offsets is a list, (path, position)
+        tuples are appended for each record.
+        """
+        record = struct.Struct('<' + ''.join(code for name, code in P2_FIELDS))
+        fields = ' '.join('{}:{}'.format(name, code) for name, code in P2_FIELDS).encode('ascii')
+        hash_name = (self.hash_name or '').encode('utf-8')
+        strings = bytearray()
+        string_offsets = {}     # reuse names that occur multiple times
+        directories = {self.path: P2_NONE}
+        count = 0
+        with open(filename, 'wb') as file_list:
+            file_list.write(P2_HEADER.pack(P2_MAGIC, P2_VERSION, record.size, 0, len(fields), len(hash_name)))
+            file_list.write(fields)
+            file_list.write(hash_name)
+            position = P2_HEADER.size + len(fields) + len(hash_name)
+            for p in self.flattened():
+                if offsets is not None:
+                    offsets.append((p.path, position + count * record.size))
+                name = p.name.encode('utf-8')
+                name_offset = string_offsets.get(name)
+                if name_offset is None:
+                    name_offset = string_offsets[name] = len(strings)
+                    strings.extend(name)
+                data_hash = p.data_hash.encode('ascii')
+                hash_offset = len(strings)
+                strings.extend(data_hash)
+                fingerprint = (p.fingerprint or '').encode('ascii')
+                fingerprint_offset = len(strings)
+                strings.extend(fingerprint)
+                s = p.stat
+                file_list.write(record.pack(
+                    directories[os.path.dirname(p.path)],
+                    name_offset, len(name),
+                    s.mode,
+                    s.uid if s.uid is not None else P2_NONE,
+                    s.gid if s.gid is not None else P2_NONE,
+                    s.flags if s.flags is not None else -1,
+                    s.size,
+                    s.atime,
+                    s.mtime,
+                    hash_offset, len(data_hash),
+                    s.dev if s.dev is not None else P2_NONE64,
+                    s.ino if s.ino is not None else P2_NONE64,
+                    s.ctime if s.ctime is not None else float('nan'),
+                    fingerprint_offset, len(fingerprint)))
+                if isinstance(p, BackupDirectory):
+                    directories[p.path] = count
+                count += 1
+            file_list.write(strings)
+            # now that the number of records is known, update the header
+            file_list.seek(0)
+            file_list.write(P2_HEADER.pack(P2_MAGIC, P2_VERSION, record.size, count, len(fields), len(hash_name)))
+
+    def _load_p2(self, filename):
+        """Read the binary format, using mmap"""
+        with open(filename, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                with memoryview(data) as view:
+                    self.add_records(self._read_p2(filename, view))
+
+    def _read_p2(self, filename, data):
+        """Generator yielding the records of the binary format in the buffer data"""
+        layout = P2Layout(filename, data)
+        self.set_hash(layout.hash_name)
+        i_parent = layout.indexes[0]
+        directories = {P2_NONE: self.path}
+        S_ISDIR = stat.S_ISDIR
+        for n, r in enumerate(layout.record.iter_unpack(data[layout.records:layout.strings])):
+            record = layout.to_record(data, os.path.join(directories[r[i_parent]], layout.name(data, r)), r)
+            if S_ISDIR(record[1]):
+                directories[n] = record[0]
+            yield record
+
+    def load_paths(self, filename, paths, recursive=True):
+        """\
+        Load only some entries of a file list, using its index: the given
+        paths, their parent directories and the contents of directories
+        (recursively or only one level). Paths that are not found are
+        skipped. Raises IOError if there is no index.
+        """
+        logging.debug('Loading {} from file list {}'.format(', '.join(paths), filename))
+        wanted = {}
+        with FileListIndex(filename + INDEX_SUFFIX) as index:
+            self.set_hash(index.hash_name)
+            self.file_format = index.file_format
+            for path in paths:
+                path = os.path.normpath(path)
+                # the root has no record, only its contents are loaded
+                if path != self.path:
+                    offset = index.find(path)
+                    if offset is None:
+                        continue
+                    wanted[path] = offset
+                    parent = os.path.dirname(path)
+                    while parent not in wanted and parent != self.path:
+                        wanted[parent] = index.find(parent)
+                        parent = os.path.dirname(parent)
+                prefix_length = len(path.rstrip(os.sep)) + 1
+                for sub_path, offset in index.iter_below(path):
+                    if recursive or os.sep not in sub_path[prefix_length:]:
+                        wanted[sub_path] = offset
+        # sorting brings parent directories before their contents
+        with open(filename, 'rb') as f:
+            if self.file_format == 'p2':
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    layout = P2Layout(filename, data)
+                    records = [layout.to_record(data, path, layout.record.unpack_from(data, wanted[path]))
+                               for path in sorted(wanted)]
+            else:
+                records = []
+                for path in sorted(wanted):
+                    f.seek(wanted[path])
+                    records.append(parse_p1_line(f.readline().decode('utf-8')))
+        for path, record in zip(sorted(wanted), records):
+            if record is None or record[0] != path:
+                raise ValueError('index does not match file list {}'.format(filename))
+        self.add_records(records)
 
     def __getitem__(self, name):
         if name == self.name:
@@ -531,8 +1089,7 @@ class FileListParser(config_file_parser.ControlFileParser):
         super().__init__()
         self.filelist = filelist
         self.filelist.set_hash(None)
-        self.last_parent_path = None
-        self.last_parent = None
+        self.last_path = None
 
     def word_hash(self):
         """Set the hash function"""
@@ -543,31 +1100,33 @@ class FileListParser(config_file_parser.ControlFileParser):
     def word_p1(self):
         """Parse file info and add it to the internal (file) tree"""
         st_mode = int(self.next_word())
-        if stat.S_ISDIR(st_mode):
-            entry = BackupDirectory(filelist=self.filelist)
-        else:
-            entry = BackupFile(filelist=self.filelist)
-        s = entry.stat
-        s.mode = st_mode
-        s.uid = int(self.next_word())
-        s.gid = int(self.next_word())
-        s.size = int(self.next_word())
-        s.atime = float(self.next_word())
-        s.mtime = float(self.next_word())
+        st_uid = int(self.next_word())
+        st_gid = int(self.next_word())
+        st_size = int(self.next_word())
+        st_atime = float(self.next_word())
+        st_mtime = float(self.next_word())
         st_flags = self.next_word()
-        if st_flags != '-':
-            s.flags = int(st_flags)
-        entry.data_hash = self.next_word()
+        data_hash = self.next_word()
         path = unescape(self.next_word())
-        path, entry.name = os.path.split(path)
-        if path == self.last_parent_path:
-            entry.parent = self.last_parent
-        else:
-            # cache last parent to speed up
-            entry.parent = self.filelist[path]
-            self.last_parent_path = path
-            self.last_parent = entry.parent
-        entry.parent.entries[entry.name] = entry
+        self.filelist.add_records([(
+            path, st_mode, st_uid, st_gid, st_size, st_atime, st_mtime,
+            int(st_flags) if st_flags != '-' else None,
+            data_hash, None, None, None, None)])
+        self.last_path = path
+
+    def word_inode(self):
+        """Device and inode number of the previous entry"""
+        s = self.filelist[self.last_path].stat
+        s.dev = int(self.next_word())
+        s.ino = int(self.next_word())
+
+    def word_ctime(self):
+        """Change time of the previous entry"""
+        self.filelist[self.last_path].stat.ctime = float(self.next_word())
+
+    def word_fingerprint(self):
+        """Fingerprint of the previous entry"""
+        self.filelist[self.last_path].fingerprint = self.next_word()
 
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
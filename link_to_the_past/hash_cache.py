@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# (C) 2012-2016 Chris Liechti <cliechti@gmx.net>
+#
+# SPDX-License-Identifier:    BSD-3-Clause
+"""\
+Link To The Past - a backup tool
+
+Cache of hashes in an extended attribute of the source files.
+
+The attribute holds the hash name, the size and the modification time (in
+ns) of the file and the hash. Writing the attribute sets the change time of
+the file, so the change time it has afterwards can not be saved in the
+attribute itself. It is kept in a file in the target instead (see
+HashCache), keyed by device and inode. The cached hash is only used when
+the file still has the same size, modification time and exactly that
+change time: any change to the file after the attribute was written (data,
+meta data or even the modification time set back) updates its change time
+and the file is read again.
+
+As the scan has seen the change time from before the attribute was
+written, the new one is passed on to the file list (see ctime_after_write),
+so that it is not taken as a change of the file (change_detection ctime).
+
+Files where the attribute can not be written (read-only file systems, no
+permission, no support) are hashed each time. Removing the attributes or
+the file in the target (or not using the cache) is always safe.
+"""
+import errno
+import logging
+import os
+import stat
+
+from .string_escape import escaped
+
+XATTR_NAME = 'user.lttp.hash'
+VERSION = 'lttp2'
+
+# devices where the attributes can not be written, they are not tried again
+_unsupported_devices = set()
+
+
+def is_supported():
+    return hasattr(os, 'setxattr')
+
+
+class HashCache(object):
+    """\
+    Remember the change time of each file after its attribute was written,
+    keyed by device and inode.
+
+    The file has a header line with the version, then one line per file:
+    dev, ino and ctime (ns). Entries are added, never removed: the ones of
+    removed files are not used again and deleting the file is always safe.
+    """
+
+    VERSION = 1
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.ctimes = {}
+        # (dev, ino) -> (st_ctime before, st_ctime after) of the attributes written in this run
+        self.written = {}
+
+    def load(self):
+        """Read the change times, if the file exists"""
+        try:
+            with open(self.filename, 'r', encoding='ascii') as f:
+                if f.readline().split() != ['lttp-hash-cache', str(self.VERSION)]:
+                    logging.info('hash cache has an other version, not used')
+                    return
+                for line in f:
+                    st_dev, st_ino, st_ctime_ns = line.split()
+                    self.ctimes[(int(st_dev), int(st_ino))] = int(st_ctime_ns)
+        except FileNotFoundError:
+            logging.debug('no hash cache: {}'.format(self.filename))
+        except (ValueError, UnicodeDecodeError) as e:
+            logging.warning('hash cache {} is damaged, not used: {}'.format(self.filename, e))
+            self.ctimes = {}
+        else:
+            logging.debug('hash cache with {} files loaded'.format(len(self.ctimes)))
+
+    def save(self):
+        """Write the change times, replacing the old file"""
+        if not os.path.isdir(os.path.dirname(self.filename)):
+            return
+        with open(self.filename + '.new', 'w', encoding='ascii') as f:
+            f.write('lttp-hash-cache {}\n'.format(self.VERSION))
+            for (st_dev, st_ino), st_ctime_ns in list(self.ctimes.items()):
+                f.write('{} {} {}\n'.format(st_dev, st_ino, st_ctime_ns))
+        os.replace(self.filename + '.new', self.filename)
+
+    def lookup(self, path, hash_name, stat_now):
+        """Return the cached hash of the file if it is still valid, else None"""
+        if self.ctimes.get((stat_now.st_dev, stat_now.st_ino)) != stat_now.st_ctime_ns:
+            return None
+        try:
+            value = os.getxattr(path, XATTR_NAME, follow_symlinks=False)
+        except OSError:
+            return None
+        try:
+            version, name, st_size, st_mtime_ns, hexdigest = value.decode('ascii').split()
+            if (version == VERSION and
+                    name == hash_name and
+                    int(st_size) == stat_now.st_size and
+                    int(st_mtime_ns) == stat_now.st_mtime_ns):
+                return hexdigest
+        except (ValueError, UnicodeDecodeError):
+            pass
+        return None
+
+    def store(self, path, hash_name, stat_before, hexdigest):
+        """\
+        Save the hash of a file, if it was not modified while it was hashed
+        (stat_before is the stat from before hashing).
+        """
+        if stat_before.st_dev in _unsupported_devices:
+            return
+        key = (stat_before.st_dev, stat_before.st_ino)
+        # an older entry must not be used if writing fails
+        self.ctimes.pop(key, None)
+        try:
+            stat_now = os.lstat(path)
+            if (not stat.S_ISREG(stat_now.st_mode) or
+                    stat_now.st_size != stat_before.st_size or
+                    stat_now.st_mtime_ns != stat_before.st_mtime_ns or
+                    stat_now.st_ctime_ns != stat_before.st_ctime_ns):
+                return
+            value = '{} {} {} {} {}'.format(
+                VERSION, hash_name, stat_before.st_size, stat_before.st_mtime_ns, hexdigest)
+            os.setxattr(path, XATTR_NAME, value.encode('ascii'), follow_symlinks=False)
+            # the change time that writing the attribute has set
+            stat_now = os.lstat(path)
+            if (stat_now.st_size == stat_before.st_size and
+                    stat_now.st_mtime_ns == stat_before.st_mtime_ns):
+                self.ctimes[key] = stat_now.st_ctime_ns
+                self.written[key] = (stat_before.st_ctime, stat_now.st_ctime)
+        except OSError as e:
+            if e.errno in (errno.EROFS, errno.ENOTSUP):
+                logging.debug('hash cache not supported on device {}: {}'.format(stat_before.st_dev, e))
+                _unsupported_devices.add(stat_before.st_dev)
+            else:
+                logging.debug('hash cache not written for {}: {}'.format(escaped(path), e))
+
+    def ctime_after_write(self, st_dev, st_ino, st_ctime):
+        """\
+        Return the change time of a file after its attribute was written, if
+        it had the change time st_ctime (in s) before, else st_ctime.
+        """
+        before, after = self.written.get((st_dev, st_ino), (None, None))
+        return after if before == st_ctime else st_ctime
+
+    def cached_hash(self, path, hash_name, calculate):
+        """\
+        Return the hash of a file from the cache or by calling calculate(path),
+        which is then stored in the cache.
+
+        >>> import tempfile
+        >>> directory = tempfile.TemporaryDirectory()
+        >>> cache = HashCache(os.path.join(directory.name, 'hash_cache'))
+        >>> path = os.path.join(directory.name, 'data')
+        >>> with open(path, 'wb') as f:
+        ...     _ = f.write(b'hello')
+        >>> def calculate(path):
+        ...     print('reading')
+        ...     with open(path, 'rb') as f:
+        ...         return f.read().decode('ascii')
+        >>> cache.cached_hash(path, 'TEST', calculate)
+        reading
+        'hello'
+        >>> cache.cached_hash(path, 'TEST', calculate)
+        'hello'
+        >>> cache.cached_hash(path, 'OTHER', calculate)
+        reading
+        'hello'
+
+        Same size and modification time, but new data:
+
+        >>> stat_old = os.stat(path)
+        >>> with open(path, 'wb') as f:
+        ...     _ = f.write(b'HELLO')
+        >>> os.utime(path, ns=(stat_old.st_atime_ns, stat_old.st_mtime_ns))
+        >>> cache.cached_hash(path, 'OTHER', calculate)
+        reading
+        'HELLO'
+        >>> os.chmod(path, 0o600)
+        >>> stat_scan = os.stat(path)
+        >>> cache.cached_hash(path, 'OTHER', calculate)
+        reading
+        'HELLO'
+
+        The change time after writing the attribute:
+
+        >>> cache.ctime_after_write(stat_scan.st_dev, stat_scan.st_ino, stat_scan.st_ctime) == os.stat(path).st_ctime
+        True
+        >>> cache.save()
+        >>> cache = HashCache(os.path.join(directory.name, 'hash_cache'))
+        >>> cache.load()
+        >>> cache.cached_hash(path, 'OTHER', calculate)
+        'HELLO'
+        >>> directory.cleanup()
+        """
+        stat_before = os.lstat(path)
+        if not stat.S_ISREG(stat_before.st_mode):
+            return calculate(path)
+        hexdigest = self.lookup(path, hash_name, stat_before)
+        if hexdigest is None:
+            hexdigest = calculate(path)
+            self.store(path, hash_name, stat_before, hexdigest)
+        return hexdigest
@@ -9,13 +9,20 @@ Link To The Past - a backup tool
 
 Scan file system to create file lists.
 """
+import concurrent.futures
 import os
 import fnmatch
+import re
 import stat
 import logging
+import threading
+import time
+import zlib
 
 from . import filelist
 from .error import BackupException
+from .speaking import nice_bytes
+from .string_escape import escaped, unescape
 
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
@@ -31,6 +38,212 @@ class ShellPattern(object):
         return fnmatch.fnmatch(filename, self.pattern)
 
 
+class ExcludeMatcher(object):
+    """\
+    All exclude patterns compiled into one test. Patterns of the form
+    "*<suffix>", where the suffix is plain text without "/", only depend on
+    the name of the entry, they are checked by the name (with a cache).
+    The other ShellPatterns are combined into one regular expression that
+    is applied to the full path. The results are the same as testing each
+    pattern on its own.
+
+    >>> m = ExcludeMatcher([ShellPattern('*.bak'), ShellPattern('*/cache/*'), ShellPattern('/tmp')])
+    >>> m.matches('/home/x.bak'), m.matches('/home/x.bak/y'), m.matches('/a/cache/b')
+    (True, False, True)
+    >>> m.matches('/tmp'), m.matches('/tmp/x'), m.matches('/home/cache')
+    (True, False, False)
+    """
+
+    CACHE_SIZE = 100000
+
+    def __init__(self, excludes):
+        self.suffixes = []
+        expressions = []
+        self.others = []
+        for exclude in excludes:
+            if isinstance(exclude, ShellPattern):
+                pattern = os.path.normcase(exclude.pattern)
+                suffix = pattern[1:]
+                if pattern.startswith('*') and suffix and not any(c in suffix for c in '*?[/' + os.sep):
+                    self.suffixes.append(suffix)
+                else:
+                    expressions.append(fnmatch.translate(pattern))
+            else:
+                self.others.append(exclude)
+        self.suffixes = tuple(self.suffixes)
+        if expressions:
+            self.regexp = re.compile('|'.join('(?:{})'.format(e) for e in expressions))
+        else:
+            self.regexp = None
+        self.names = {}     # name -> result of suffix test
+
+    def matches(self, path):
+        """Test if path matches any of the patterns"""
+        normalized = os.path.normcase(path)
+        if self.suffixes:
+            name = os.path.basename(normalized)
+            try:
+                if self.names[name]:
+                    return True
+            except KeyError:
+                result = name.endswith(self.suffixes)
+                if len(self.names) >= self.CACHE_SIZE:
+                    self.names.clear()
+                self.names[name] = result
+                if result:
+                    return True
+        if self.regexp is not None and self.regexp.match(normalized):
+            return True
+        return any(exclude.matches(path) for exclude in self.others)
+
+
+class FilePolicy(object):
+    """\
+    Choices per file, selected by shell patterns (on the full path):
+    checksum tells if the contents are hashed, force_copy if the file is
+    copied even if it did not change, fingerprint_file if a fingerprint is
+    used to detect changes. The patterns are compiled on first use, so they
+    have to be added before.
+
+    >>> p = FilePolicy()
+    >>> p.no_checksum.append(ShellPattern('*.mkv'))
+    >>> p.force_copy.append(ShellPattern('*.db'))
+    >>> p.checksum('/a/b.txt'), p.checksum('/a/b.mkv')
+    (True, False)
+    >>> p.force_copy_file('/a/x.db'), p.force_copy_file('/a/x.txt')
+    (True, False)
+    >>> p.fingerprint_file('/a/x.db')
+    False
+    >>> p = FilePolicy()
+    >>> p.no_checksum.append(ShellPattern('*.mkv'))
+    >>> p.enable_checksum.append(ShellPattern('/home/*'))
+    >>> p.checksum('/a/b.txt'), p.checksum('/home/b.txt'), p.checksum('/home/b.mkv')
+    (False, True, False)
+    """
+
+    def __init__(self):
+        # if enable_checksum is not empty, only matching files are hashed
+        self.enable_checksum = []
+        self.no_checksum = []
+        self.force_copy = []
+        self.fingerprint = []
+        self._matchers = None
+
+    def _compile(self):
+        self._matchers = [
+            ExcludeMatcher(patterns) if patterns else None
+            for patterns in (self.enable_checksum, self.no_checksum, self.force_copy, self.fingerprint)]
+        return self._matchers
+
+    def checksum(self, path):
+        """Check if the contents of the file should be hashed"""
+        enable, disable, force, fingerprint = self._matchers or self._compile()
+        if enable is not None and not enable.matches(path):
+            return False
+        return disable is None or not disable.matches(path)
+
+    def force_copy_file(self, path):
+        """Check if the file should always be copied"""
+        enable, disable, force, fingerprint = self._matchers or self._compile()
+        return force is not None and force.matches(path)
+
+    def fingerprint_file(self, path):
+        """Check if a fingerprint of the file should be made"""
+        enable, disable, force, fingerprint = self._matchers or self._compile()
+        return fingerprint is not None and fingerprint.matches(path)
+
+
+def excludes_checksum(excludes, settings=()):
+    """\
+    Checksum over the exclude patterns (and other settings, as strings),
+    used to detect configuration changes.
+
+    >>> excludes_checksum([ShellPattern('*.bak')])
+    'e06be5cd'
+    """
+    return '{:08x}'.format(zlib.crc32('\n'.join(
+        [exclude.pattern for exclude in excludes] + list(settings)).encode('utf-8')))
+
+
+class ScanCache(object):
+    """\
+    Remember the names in each directory, keyed by device and inode of the
+    directory. As long as the modification and change time of a directory
+    are the same, its names are taken from the cache instead of reading the
+    directory (the entries are still stat'ed).
+
+    A directory that is modified within the same tick of its time stamps as
+    it is read keeps its times, so its listing is not stored if its times
+    are less than RACY_SECONDS before the start of the scan (or later): it is
+    read again the next time.
+
+    The file has a header line with the version and a checksum of the
+    exclude patterns (the cache is not used if they change), then one line
+    per directory: dev, ino, mtime and ctime (ns) and the escaped names.
+    """
+
+    VERSION = 1
+
+    # the time stamps of FAT, SMB and some NFS mounts have 1-2 s resolution
+    RACY_SECONDS = 2
+
+    def __init__(self, filename, excludes=()):
+        self.filename = filename
+        self.excludes_key = excludes_checksum(excludes)
+        self.old = {}   # loaded from file
+        self.new = {}   # directories seen by this scan
+        self.racy_after = time.time() - self.RACY_SECONDS
+
+    def load(self):
+        """Read the cache, if it exists and matches the configuration"""
+        try:
+            with open(self.filename, 'r', encoding='utf-8') as f:
+                header = f.readline().split()
+                if header != ['lttp-scan-cache', str(self.VERSION), self.excludes_key]:
+                    logging.info('scan cache does not match configuration, not used')
+                    return
+                for line in f:
+                    if '\\ ' in line:
+                        line = line.replace('\\ ', '\\x20')
+                    fields = line.split()
+                    self.old[(int(fields[0]), int(fields[1]))] = (
+                        int(fields[2]),
+                        int(fields[3]),
+                        [unescape(name) for name in fields[4:]])
+        except FileNotFoundError:
+            logging.debug('no scan cache: {}'.format(self.filename))
+        except (ValueError, IndexError) as e:
+            logging.warning('scan cache {} is damaged, not used: {}'.format(self.filename, e))
+            self.old = {}
+        else:
+            logging.debug('scan cache with {} directories loaded'.format(len(self.old)))
+
+    def save(self):
+        """Write the directories of this scan, replacing the old cache"""
+        if not os.path.isdir(os.path.dirname(self.filename)):
+            return
+        with open(self.filename + '.new', 'w', encoding='utf-8') as f:
+            f.write('lttp-scan-cache {} {}\n'.format(self.VERSION, self.excludes_key))
+            for (st_dev, st_ino), (mtime, ctime, names) in self.new.items():
+                f.write('{} {} {} {} {}\n'.format(st_dev, st_ino, mtime, ctime, ' '.join(escaped(name) for name in names)))
+        os.replace(self.filename + '.new', self.filename)
+
+    def get(self, stat_dir):
+        """Return the names of a directory or None if not cached or changed"""
+        cached = self.old.get((stat_dir.st_dev, stat_dir.st_ino))
+        if cached is not None and cached[0] == stat_dir.st_mtime_ns and cached[1] == stat_dir.st_ctime_ns:
+            return cached[2]
+        return None
+
+    def put(self, stat_dir, names):
+        """Remember the names of a directory, unless it was modified just now"""
+        key = (stat_dir.st_dev, stat_dir.st_ino)
+        if stat_dir.st_mtime >= self.racy_after or stat_dir.st_ctime >= self.racy_after:
+            self.new.pop(key, None)
+            return
+        self.new[key] = (stat_dir.st_mtime_ns, stat_dir.st_ctime_ns, names)
+
+
 class Location(object):
     """A location on the file system, used as source for backups"""
     def __init__(self, path):
@@ -40,70 +253,371 @@ class Location(object):
     def __repr__(self):
         return 'Location({!r})'.format(self.path)
 
-    def _scan(self, indexer, parent, device):
-        """scan recursively and handle excluded files and directories on the fly"""
-        logging.debug('scanning {!r}'.format(parent.path))
-        for direntry in os.scandir(parent.path):
+    @staticmethod
+    def _is_wanted(path, stat_now, device):
+        """Check the type and device of an entry"""
+        # do not cross filesystem boundaries
+        if stat_now.st_dev != device:
+            logging.warning('will not cross filesystems, ignoring: {!r}'.format(path))
+            return False
+        # store dirs and files
+        mode = stat_now.st_mode
+        return stat.S_ISDIR(mode) or stat.S_ISREG(mode) or stat.S_ISLNK(mode)
+        #~ elif stat.S_ISCHR(mode):
+        #~ elif stat.S_ISBLK(mode):
+        #~ elif stat.S_ISFIFO(mode):
+        #~ elif stat.S_ISSOCK(mode):
+        #~ else:
+            # ignore everything else
+
+    def _list_cached(self, path, names, device):
+        """\
+        Same as _list_directory, for names from the scan cache. Returns None
+        if an entry does not exist anymore.
+        """
+        listing = []
+        for name in names:
+            entry_path = os.path.join(path, name)
+            try:
+                stat_now = os.lstat(entry_path)
+            except FileNotFoundError:
+                return None
+            except OSError:  # permission error
+                logging.error('access failed, ignoring: {!r}'.format(entry_path))
+                continue
+            if self._is_wanted(entry_path, stat_now, device):
+                listing.append((name, stat_now))
+        return listing
+
+    def _list_directory(self, indexer, path, device):
+        """\
+        Read one directory and return a list of (name, stat) tuples for the
+        entries that are included in the backup. Excluded entries, entries
+        that can not be accessed and entries on other file systems are
+        filtered out, as well as entries removed by indexer.prune. This is
+        safe to run in a worker thread.
+        """
+        return indexer.prune(path, self._read_directory(indexer, path, device))
+
+    def _read_directory(self, indexer, path, device):
+        """Read one directory (or get the names from the scan cache)"""
+        cache = indexer.scan_cache
+        if cache is not None:
+            stat_dir = os.lstat(path)
+            names = cache.get(stat_dir) if not indexer.strict_scan else None
+            if names is not None:
+                listing = self._list_cached(path, names, device)
+                if listing is not None:
+                    logging.debug('scanning {!r} (cached)'.format(path))
+                    cache.put(stat_dir, names)
+                    return listing
+        logging.debug('scanning {!r}'.format(path))
+        listing = []
+        names = []
+        for direntry in os.scandir(path):
             if indexer.is_included(direntry.path):
                 #~ logging.debug('is included %r' % (direntry.path,))
+                names.append(direntry.name)
                 try:
                     stat_now = direntry.stat(follow_symlinks=False)
                 except OSError:  # permission error
                     logging.error('access failed, ignoring: {!r}'.format(direntry.path))
                     continue
-                # do not cross filesystem boundaries
-                if stat_now.st_dev != device:
-                    logging.warning('will not cross filesystems, ignoring: {!r}'.format(direntry.path))
-                    continue
-                # store dirs and files
-                mode = stat_now.st_mode
-                if stat.S_ISDIR(mode):
-                    d = parent.new_dir(direntry.name, stat_now=stat_now)
-                    self._scan(indexer, d, device)
-                elif stat.S_ISREG(mode) or stat.S_ISLNK(mode):
-                    parent.new_file(direntry.name, stat_now=stat_now)
-                #~ elif stat.S_ISCHR(mode):
-                #~ elif stat.S_ISBLK(mode):
-                #~ elif stat.S_ISFIFO(mode):
-                #~ elif stat.S_ISSOCK(mode):
-                #~ else:
-                    # ignore everything else
+                if self._is_wanted(direntry.path, stat_now, device):
+                    listing.append((direntry.name, stat_now))
             #~ else:
                 #~ logging.debug('is excluded %r' % (direntry.path,))
+        if cache is not None:
+            cache.put(stat_dir, names)
+        return listing
+
+    @staticmethod
+    def _add_entries(indexer, parent, listing):
+        """\
+        Add the result of _list_directory to the tree, return new
+        sub-directories. The new entries are reported to the indexer.
+        """
+        entries = []
+        directories = []
+        for name, stat_now in listing:
+            if stat.S_ISDIR(stat_now.st_mode):
+                entry = parent.new_dir(name, stat_now=stat_now)
+                directories.append(entry)
+            else:
+                entry = parent.new_file(name, stat_now=stat_now)
+            entries.append(entry)
+        indexer.added(entries)
+        return directories
+
+    def _scan(self, indexer, parent, device):
+        """scan recursively and handle excluded files and directories on the fly"""
+        for directory in self._add_entries(indexer, parent, self._list_directory(indexer, parent.path, device)):
+            self._scan(indexer, directory, device)
+
+    @staticmethod
+    def _add_reference_entries(indexer, parent, reference):
+        """\
+        Same as _add_entries but the entries are copied from a directory of
+        an other file list (the last backup), without reading the source.
+        """
+        entries = []
+        directories = []
+        for other in reference:
+            if stat.S_ISDIR(other.stat.mode):
+                entry = parent.new_dir(other.name)
+                directories.append((entry, other))
+            else:
+                entry = parent.new_file(other.name)
+            entry.stat.update(other.stat)
+            entries.append(entry)
+        indexer.added(entries)
+        return directories
+
+    def _scan_changes(self, indexer, parent, reference, device):
+        """\
+        Same as _scan but only the directories in indexer.changes are read,
+        the others are taken from the reference (the same directory in the
+        last backup).
+        """
+        if reference is None or indexer.changes.is_dirty(parent.path):
+            for directory in self._add_entries(indexer, parent, self._list_directory(indexer, parent.path, device)):
+                try:
+                    other = reference.entries[directory.name]
+                except (AttributeError, KeyError):
+                    other = None
+                else:
+                    if not stat.S_ISDIR(other.stat.mode):
+                        other = None
+                self._scan_changes(indexer, directory, other, device)
+        else:
+            for directory, other in self._add_reference_entries(indexer, parent, reference):
+                self._scan_changes(indexer, directory, other, device)
+
+    def _scan_parallel(self, indexer, parent, device, executor):
+        """\
+        Same as _scan but directories are read by a pool of worker threads.
+        The tree itself is only modified in the calling thread, each directory
+        gets its entries in the same order as with _scan.
+        """
+        pending = {executor.submit(self._list_directory, indexer, parent.path, device): parent}
+        while pending:
+            done, not_done = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                directory = pending.pop(future)
+                for subdirectory in self._add_entries(indexer, directory, future.result()):
+                    pending[executor.submit(self._list_directory, indexer, subdirectory.path, device)] = subdirectory
 
-    def scan(self, indexer):
-        """Find all files in the source directory"""
+    def scan(self, indexer, executor=None):
+        """\
+        Find all files in the source directory. If an executor is given,
+        directories are read in parallel.
+        """
         path = os.path.abspath(self.path)
         if os.path.isdir(path):
             parents = path.split(os.sep)
             del parents[0]  # remove empty root
             parent = indexer.root
-            for name in parents:
-                entry = parent.new_dir(name)
-                entry.stat.extract(os.stat(entry.path, follow_symlinks=False))
+            for n, name in enumerate(parents, 1):
+                try:
+                    entry = parent[name]
+                except KeyError:
+                    entry = parent.new_dir(name)
+                    entry.stat.extract(os.stat(entry.path, follow_symlinks=False))
+                    indexer.added([entry])
+                else:
+                    if n == len(parents):
+                        # nested include, already scanned as part of an other location
+                        logging.debug('already scanned: {!r}'.format(self.path))
+                        return
                 parent = entry
-            self._scan(indexer, parent, os.stat(path, follow_symlinks=False).st_dev)
+            device = os.stat(path, follow_symlinks=False).st_dev
+            if indexer.changes is not None:
+                try:
+                    reference = indexer.reference[path]
+                except KeyError:
+                    reference = None
+                else:
+                    if not stat.S_ISDIR(reference.stat.mode):
+                        reference = None
+                self._scan_changes(indexer, parent, reference, device)
+            elif executor is not None:
+                self._scan_parallel(indexer, parent, device, executor)
+            else:
+                self._scan(indexer, parent, device)
         else:
             raise BackupException('location is not a directory: {!r}'.format(self.path))
 
 
+CACHEDIR_TAG = 'CACHEDIR.TAG'
+CACHEDIR_SIGNATURE = b'Signature: 8a477f597d28d172789f06886806bc55'
+
+
+def is_cachedir_tag(path):
+    """Check if the file is a valid cache directory tag (bford.info/cachedir)"""
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(CACHEDIR_SIGNATURE)) == CACHEDIR_SIGNATURE
+    except OSError:
+        return False
+
+
 class Indexer(object):
     """Manage a tree of files and directories."""
     def __init__(self, filelist):
         self.includes = []
         self.excludes = []
         self.root = filelist
+        self.scan_threads = 1
+        # optional callback, it gets each list of new entries while scanning.
+        # directories are reported before their contents
+        self.on_added = None
+        # if a file name is set, a ScanCache is used. in strict mode, it is
+        # only written, all directories are read
+        self.scan_cache_file = None
+        self.strict_scan = False
+        self.scan_cache = None
+        # if changes (journal.Changes) are set, only these directories are
+        # read, the rest is copied from the reference (a FileList)
+        self.changes = None
+        self.reference = None
+        self.exclude_matcher = None     # compiled from excludes on first use
+        # pruning: directories with marker files are backed up with the
+        # marker only, files larger than max_file_size are skipped
+        self.exclude_caches = False
+        self.markers = set()
+        self.max_file_size = None
+        self.pruned_directories = 0
+        self.skipped_files = 0
+        self.skipped_entries = 0
+        self.skipped_bytes = 0
+        self.prune_lock = threading.Lock()
+        # set by limit_to, only parts of the locations are scanned
+        self.partial = False
 
     def is_included(self, name):
-        for exclude in self.excludes:
-            if exclude.matches(name):
-                return False
-        return True
+        if self.exclude_matcher is None:
+            self.exclude_matcher = ExcludeMatcher(self.excludes)
+        return not self.exclude_matcher.matches(name)
+
+    def filter_checksum(self):
+        """Checksum over all settings that select entries"""
+        settings = []
+        if self.exclude_caches:
+            settings.append('exclude_caches')
+        for marker in sorted(self.markers):
+            settings.append('exclude_if_present {}'.format(marker))
+        if self.max_file_size is not None:
+            settings.append('max_file_size {}'.format(self.max_file_size))
+        return excludes_checksum(self.excludes, settings)
+
+    def prune(self, path, listing):
+        """\
+        Remove entries from the listing of a directory: if the directory
+        contains a marker file (or a cache directory tag), only the marker is
+        kept, the rest is skipped without reading it. Files larger than
+        max_file_size are skipped.
+        """
+        if not (self.exclude_caches or self.markers or self.max_file_size is not None):
+            return listing
+        found = [name for name, stat_now in listing
+                 if name in self.markers or
+                 (self.exclude_caches and name == CACHEDIR_TAG and is_cachedir_tag(os.path.join(path, name)))]
+        if found:
+            logging.info('skipping contents of {!r}, found {}'.format(path, ', '.join(found)))
+            kept = [(name, stat_now) for name, stat_now in listing if name in found]
+            pruned_directories = 1
+            skipped_files = 0
+        elif self.max_file_size is not None:
+            kept = []
+            for name, stat_now in listing:
+                if stat.S_ISREG(stat_now.st_mode) and stat_now.st_size > self.max_file_size:
+                    logging.info('skipping large file {!r}'.format(os.path.join(path, name)))
+                else:
+                    kept.append((name, stat_now))
+            pruned_directories = 0
+            skipped_files = len(listing) - len(kept)
+        else:
+            return listing
+        if len(kept) != len(listing):
+            skipped_bytes = sum(stat_now.st_size for name, stat_now in listing
+                                if stat.S_ISREG(stat_now.st_mode)) - \
+                            sum(stat_now.st_size for name, stat_now in kept
+                                if stat.S_ISREG(stat_now.st_mode))
+            with self.prune_lock:
+                self.pruned_directories += pruned_directories
+                self.skipped_files += skipped_files
+                self.skipped_entries += len(listing) - len(kept)
+                self.skipped_bytes += skipped_bytes
+        return kept
+
+    def limit_to(self, paths):
+        """\
+        Only scan the given directories: locations below one of the paths
+        are kept, locations containing a path are replaced by the path.
+        Paths outside of all locations or excluded paths are skipped.
+        """
+        includes = []
+        for path in paths:
+            path = os.path.normpath(os.path.abspath(path))
+            found = False
+            for location in self.includes:
+                if location.path == path or location.path.startswith(path.rstrip(os.sep) + os.sep):
+                    includes.append(location)
+                    found = True
+                elif path.startswith(location.path.rstrip(os.sep) + os.sep):
+                    parent = path
+                    while parent != location.path:
+                        if not self.is_included(parent):
+                            logging.warning('excluded: {!r}'.format(path))
+                            break
+                        parent = os.path.dirname(parent)
+                    else:
+                        includes.append(Location(path))
+                    found = True
+            if not found:
+                logging.warning('not in any location: {!r}'.format(path))
+        # remove duplicates, e.g. when paths overlap
+        self.includes = list({location.path: location for location in includes}.values())
+        self.partial = True
+
+    def added(self, entries):
+        """Called with a list of entries that were added to the tree"""
+        if self.on_added is not None:
+            self.on_added(entries)
 
     def scan(self):
         """Find all files contained in the current backup"""
-        for location in self.includes:
-            location.scan(self)
+        # parents first, so that nested includes (e.g. file systems mounted
+        # within a location) are added to the already scanned tree
+        self.includes.sort(key=lambda location: location.path)
+        self.exclude_matcher = ExcludeMatcher(self.excludes)
+        self.pruned_directories = self.skipped_files = self.skipped_entries = self.skipped_bytes = 0
+        if self.scan_cache_file is not None:
+            self.scan_cache = ScanCache(self.scan_cache_file, self.excludes)
+            if not self.strict_scan:
+                self.scan_cache.load()
+            if self.changes is not None or self.partial:
+                # most directories are not visited, keep their listings
+                self.scan_cache.new.update(self.scan_cache.old)
+        if self.scan_threads > 1:
+            logging.debug('scanning with {} threads'.format(self.scan_threads))
+            with concurrent.futures.ThreadPoolExecutor(self.scan_threads) as executor:
+                for location in self.includes:
+                    location.scan(self, executor)
+        else:
+            for location in self.includes:
+                location.scan(self)
+        if self.scan_cache is not None:
+            self.scan_cache.save()
+            self.scan_cache = None
+        if self.skipped_entries:
+            # pruned directories are not read, only their first level is counted
+            logging.info('Skipped {} large files and the contents of {} directories with marker files: '
+                         '{} entries, {} (not counting sub-directories of these)'.format(
+                self.skipped_files,
+                self.pruned_directories,
+                self.skipped_entries,
+                nice_bytes(self.skipped_bytes)))
 
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# (C) 2012-2016 Chris Liechti <cliechti@gmx.net>
+#
+# SPDX-License-Identifier:    BSD-3-Clause
+"""\
+Link To The Past - a backup tool
+
+Check the files in backups against the hashes stored in their file lists.
+
+Most files in a backup are hard links to the same file in other backups.
+Each file on disk (device and inode) is only read once, the result is used
+for all paths (and backups) that link to it. The files are hashed by a pool
+of threads, the results are reported in the order of the file list.
+
+The hashes are also written to a checkpoint file in the target. When a check
+is interrupted and started again, the files in the checkpoint are not read
+again. The checkpoint is removed when a check is complete, one that is
+older than MAX_AGE is not used (the files may have changed on disk since
+they were read). Without write
+access to the target (e.g. read-only media) the check runs without it.
+
+For regular checks of large targets, a sample can be checked instead: the
+files that were not verified for the longest time, up to a number of bytes.
+When each file was verified last is saved in a state file in the target.
+"""
+import collections
+import concurrent.futures
+import logging
+import os
+import time
+
+from . import filelist
+from .string_escape import escaped
+
+CHECKPOINT_NAME = 'integrity_checkpoint'
+STATE_NAME = 'integrity_state'
+
+
+class Checkpoint(object):
+    """\
+    Hashes of the files that were already checked. A header line with the
+    time when the check was started, then one line per file: device, inode,
+    size, mtime (ns), hash name and hash.
+    """
+
+    FLUSH_INTERVAL = 10     # seconds
+    MAX_AGE = 7 * 24 * 3600     # seconds, older checkpoints are not used
+    HEADER = 'lttp-integrity-checkpoint'
+
+    def __init__(self, target_path):
+        self.filename = os.path.join(target_path, CHECKPOINT_NAME)
+        self.f = None
+        self.last_flush = 0
+
+    def load(self):
+        """Return a dict with the hashes of the last, interrupted check"""
+        results = {}
+        try:
+            with open(self.filename, 'r', encoding='utf-8') as f:
+                header = f.readline().split()
+                try:
+                    started = float(header[1]) if header[0] == self.HEADER else None
+                except (IndexError, ValueError):
+                    started = None
+                if started is None or not 0 <= time.time() - started <= self.MAX_AGE:
+                    logging.warning('checkpoint is too old or damaged, starting over: {}'.format(self.filename))
+                    self.remove()
+                    return results
+                for line in f:
+                    fields = line.split()
+                    if len(fields) != 6:
+                        continue    # last line may be incomplete
+                    st_dev, st_ino, st_size, st_mtime_ns, hash_name, hexdigest = fields
+                    results[(int(st_dev), int(st_ino), int(st_size), int(st_mtime_ns), hash_name)] = hexdigest
+        except FileNotFoundError:
+            pass
+        return results
+
+    def open(self):
+        self.f = open(self.filename, 'a', encoding='utf-8')
+        self.last_flush = time.time()
+        if self.f.tell() == 0:
+            self.f.write('{} {:.0f}\n'.format(self.HEADER, self.last_flush))
+
+    def add(self, key, hexdigest):
+        self.f.write('{} {} {} {} {} {}\n'.format(*(key + (hexdigest,))))
+        now = time.time()
+        if now - self.last_flush > self.FLUSH_INTERVAL:
+            self.f.flush()
+            self.last_flush = now
+
+    def close(self):
+        self.f.close()
+
+    def remove(self):
+        try:
+            os.remove(self.filename)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.warning('checkpoint not removed: {}'.format(e))
+
+
+class SampleState(object):
+    """\
+    When each file (device, inode, size, mtime in ns) was verified last. One
+    line per file with the key and the time.
+    """
+
+    def __init__(self, target_path):
+        self.filename = os.path.join(target_path, STATE_NAME)
+        self.verified = {}
+
+    def load(self):
+        try:
+            with open(self.filename, 'r', encoding='utf-8') as f:
+                for line in f:
+                    st_dev, st_ino, st_size, st_mtime_ns, timestamp = line.split()
+                    self.verified[(int(st_dev), int(st_ino), int(st_size), int(st_mtime_ns))] = float(timestamp)
+        except FileNotFoundError:
+            pass
+        except ValueError as e:
+            logging.warning('integrity state is damaged, starting over: {}'.format(e))
+            self.verified = {}
+
+    def save(self, keys):
+        """Write the times of the files that still exist (keys)"""
+        with open(self.filename + '.new', 'w', encoding='utf-8') as f:
+            for key in keys:
+                timestamp = self.verified.get(key)
+                if timestamp is not None:
+                    f.write('{} {} {} {} {:.0f}\n'.format(*(key + (timestamp,))))
+        os.replace(self.filename + '.new', self.filename)
+
+
+def file_keys(file_list):
+    """\
+    Generator yielding (key, size) for the files of a file list that exist in
+    the backup and have a hash.
+    """
+    for path, dirs, files in file_list.walk():
+        for entry in files:
+            if entry.data_hash == '-' and file_list.hash_name is not None:
+                continue
+            try:
+                stat_now = os.lstat(entry.backup_path)
+            except FileNotFoundError:
+                continue
+            yield (stat_now.st_dev, stat_now.st_ino, stat_now.st_size, stat_now.st_mtime_ns), stat_now.st_size
+
+
+def select_sample(sizes, state, budget):
+    """\
+    Choose the files that were not verified for the longest time (never
+    verified first), up to budget bytes (at least one file). sizes maps the
+    keys of all files to their size. Returns a set of keys.
+
+    >>> sizes = {1: 100, 2: 100, 3: 100, 4: 100}
+    >>> state = SampleState('.')
+    >>> state.verified = {1: 50.0, 2: 10.0}
+    >>> sorted(select_sample(sizes, state, 300))
+    [2, 3, 4]
+    """
+    selected = set()
+    total = 0
+    for key in sorted(sizes, key=lambda key: state.verified.get(key, 0)):
+        if selected and total + sizes[key] > budget:
+            break
+        selected.add(key)
+        total += sizes[key]
+    return selected
+
+
+class IntegrityChecker(object):
+    """Check file lists against the files in the backup, see module doc"""
+
+    def __init__(self, threads=4, checkpoint=None, selected=None):
+        self.threads = threads
+        self.checkpoint = checkpoint
+        # if set, only files with these keys are checked (see select_sample)
+        self.selected = selected
+        self.results = {}   # (dev, ino, size, mtime_ns, hash_name) -> hash or Future
+        # key -> True if the hash matched for all entries of the file (see verified_keys)
+        self.matched = {}
+        self.counts = collections.Counter()
+        self.files_read = 0
+        self.files_resumed = 0
+
+    def __enter__(self):
+        self.executor = concurrent.futures.ThreadPoolExecutor(self.threads)
+        if self.checkpoint is not None:
+            self.results = self.checkpoint.load()
+            self.files_resumed = len(self.results)
+            if self.results:
+                logging.info('Resuming check, {} files already checked'.format(len(self.results)))
+            try:
+                self.checkpoint.open()
+            except OSError as e:
+                # e.g. a read-only target, the check itself does not need it
+                logging.warning('no checkpoint, an interrupted check starts over: {}'.format(e))
+                self.checkpoint = None
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # not started yet, e.g. when interrupted (shutdown(cancel_futures=True) needs Python 3.9)
+        for result in self.results.values():
+            if isinstance(result, concurrent.futures.Future):
+                result.cancel()
+        self.executor.shutdown(wait=exc_type is None)
+        if self.checkpoint is not None:
+            self.checkpoint.close()
+            if exc_type is None:
+                self.checkpoint.remove()
+
+    def _submit(self, entry):
+        """Start the check of one entry, return a status or the key of its hash"""
+        if isinstance(entry, filelist.BackupDirectory):
+            return 'OK' if os.path.isdir(entry.backup_path) else 'MISSING'
+        try:
+            stat_now = os.lstat(entry.backup_path)
+        except FileNotFoundError:
+            return 'MISSING'
+        if entry.data_hash == '-' and entry.filelist.hash_name is not None:
+            # no hash recorded for this file (no_checksum, enable_checksum)
+            return 'UNCHECKED'
+        key = (stat_now.st_dev, stat_now.st_ino, stat_now.st_size, stat_now.st_mtime_ns, entry.filelist.hash_name)
+        if self.selected is not None and key[:4] not in self.selected:
+            return 'SKIPPED'
+        if key not in self.results:
+            self.results[key] = self.executor.submit(entry._calculate_hash, entry.backup_path)
+            self.files_read += 1
+        return key
+
+    def _result(self, entry, item):
+        """Wait for the result of _submit, return the status"""
+        if isinstance(item, str):
+            return item
+        hexdigest = self.results[item]
+        if isinstance(hexdigest, concurrent.futures.Future):
+            try:
+                hexdigest = hexdigest.result()
+            except OSError as e:
+                logging.error('Error reading {}: {}'.format(escaped(entry.backup_path), e))
+                hexdigest = 'ERROR'
+            else:
+                if self.checkpoint is not None:
+                    self.checkpoint.add(item, hexdigest)
+            self.results[item] = hexdigest
+        ok = hexdigest == entry.data_hash
+        self.matched[item] = ok and self.matched.get(item, True)
+        return 'OK' if ok else 'CORRUPTED'
+
+    def verified_keys(self):
+        """The keys of the files that were checked, with status OK"""
+        return [key for key, ok in self.matched.items() if ok]
+
+    def check(self, file_list):
+        """\
+        Generator yielding (status, entry) for all entries of a file list,
+        in order, status is OK, CORRUPTED, MISSING, UNCHECKED or SKIPPED
+        (not in the selection).
+        """
+        window = self.threads * 16
+        pending = collections.deque()
+        for path, dirs, files in file_list.walk():
+            for entry in dirs + files:
+                pending.append((entry, self._submit(entry)))
+                while len(pending) > window:
+                    entry, item = pending.popleft()
+                    yield self._count(self._result(entry, item), entry)
+        while pending:
+            entry, item = pending.popleft()
+            yield self._count(self._result(entry, item), entry)
+
+    def _count(self, status, entry):
+        if not isinstance(entry, filelist.BackupDirectory):
+            self.counts[status] += 1
+        return status, entry
+
+    def log_summary(self):
+        logging.info('Checked {} files ({} read, {} hashes from checkpoint): {}'.format(
+            sum(self.counts.values()),
+            self.files_read,
+            self.files_resumed,
+            ', '.join('{} {}'.format(n, status) for status, n in sorted(self.counts.items()))))
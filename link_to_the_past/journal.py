@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# (C) 2012-2016 Chris Liechti <cliechti@gmx.net>
+#
+# SPDX-License-Identifier:    BSD-3-Clause
+"""\
+Link To The Past - a backup tool
+
+Journal of changed directories. It is written by the "watch" action and
+used by "create" to read only the directories that changed since the last
+backup, everything else is taken from the file list of the last backup.
+
+The journal is a text file in the target directory. The first line is a
+header with the version, the checksum of the settings that select entries
+(see Indexer.filter_checksum) and the process id of the watcher. Then one
+command per line:
+
+``ready``
+    all directories are watched, changes are recorded from now on
+``dir <path>``
+    entries in the directory were added, removed or modified
+``tree <path>``
+    the directory and everything below it is new (e.g. moved in)
+``overflow``
+    changes were lost, the next backup needs a full scan
+``stopped``
+    the watcher has ended
+``mark <token>``
+    written by "create" before scanning. The token is saved in the backup,
+    the next backup uses the changes recorded after the mark.
+
+Both processes append to the file, each line is written with one call
+while holding a lock on the journal (flock), so that the watcher sees each
+mark before it writes the next line.
+
+While the watcher is running, it holds a lock on a second file in the
+target. If the lock is not held, the watcher has ended (even if it was
+killed and could not write "stopped") and the journal is not used.
+"""
+import fcntl
+import logging
+import os
+import time
+
+from .error import BackupException
+
+from .string_escape import escaped, unescape
+
+JOURNAL_NAME = 'watch_journal'
+MARK_NAME = 'watch_mark'
+LOCK_NAME = 'watch_lock'
+
+VERSION = 1
+
+
+class Changes(object):
+    """The directories recorded in the journal since a mark"""
+
+    def __init__(self):
+        self.dirs = set()
+        self.trees = set()
+
+    def __len__(self):
+        return len(self.dirs) + len(self.trees)
+
+    def is_dirty(self, path):
+        """\
+        Check if a directory has to be read.
+
+        >>> c = Changes()
+        >>> c.dirs.add('/a/b')
+        >>> c.trees.add('/x')
+        >>> c.is_dirty('/a/b'), c.is_dirty('/a'), c.is_dirty('/a/b/c')
+        (True, False, False)
+        >>> c.is_dirty('/x'), c.is_dirty('/x/y/z'), c.is_dirty('/xy')
+        (True, True, False)
+        """
+        if path in self.dirs:
+            return True
+        while True:
+            if path in self.trees:
+                return True
+            parent = os.path.dirname(path)
+            if parent == path:
+                return False
+            path = parent
+
+
+class Journal(object):
+    """Read and write the journal of a backup target"""
+
+    def __init__(self, target_path, filter_key):
+        self.filename = os.path.join(target_path, JOURNAL_NAME)
+        self.lock_filename = os.path.join(target_path, LOCK_NAME)
+        self.filter_key = filter_key    # see Indexer.filter_checksum
+        self.fd = None
+        self.lock_fd = None
+        self.position = 0
+        self.written = set()
+
+    def exists(self):
+        return os.path.exists(self.filename)
+
+    def watcher_alive(self):
+        """Check if a watcher holds the lock of this target"""
+        try:
+            fd = os.open(self.lock_filename, os.O_RDONLY)
+        except FileNotFoundError:
+            return False
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        finally:
+            os.close(fd)
+        return False
+
+    # - - - writer (watch) - - -
+
+    def start(self):
+        """\
+        Create a new journal, replacing an old one. Raises BackupException if
+        an other watcher is running for the target.
+        """
+        self.lock_fd = os.open(self.lock_filename, os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(self.lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(self.lock_fd)
+            self.lock_fd = None
+            raise BackupException('an other watcher is running for this target')
+        with open(self.filename, 'w', encoding='utf-8') as f:
+            f.write('lttp-watch-journal {} {} {}\n'.format(VERSION, self.filter_key, os.getpid()))
+        self.fd = os.open(self.filename, os.O_WRONLY | os.O_APPEND)
+        self.position = os.fstat(self.fd).st_size
+        self.written.clear()
+
+    def write(self, command, path=None):
+        """\
+        Append a command to the journal. Paths are only written once between
+        two marks.
+        """
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self.fd).st_size != self.position:
+                # create added a mark, changes are recorded again
+                self.written.clear()
+            if path is not None:
+                if (command, path) in self.written:
+                    return
+                self.written.add((command, path))
+                line = '{} {}\n'.format(command, escaped(path))
+            else:
+                line = '{}\n'.format(command)
+            os.write(self.fd, line.encode('utf-8'))
+            self.position = os.fstat(self.fd).st_size
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def stop(self):
+        self.write('stopped')
+        os.close(self.fd)
+        self.fd = None
+        os.close(self.lock_fd)     # releases the lock
+        self.lock_fd = None
+
+    # - - - reader (create) - - -
+
+    def add_mark(self):
+        """Append a new mark to the journal, return its token"""
+        token = '{:.6f}-{}'.format(time.time(), os.getpid())
+        with open(self.filename, 'a', encoding='utf-8') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.write('mark {}\n'.format(token))
+            f.flush()
+        return token
+
+    def changes_since(self, token):
+        """\
+        Return the Changes recorded after the mark with the given token or
+        None if the journal is not complete since then (the watcher was not
+        running, was stopped, or lost events).
+        """
+        if not self.watcher_alive():
+            logging.info('watch journal: watcher is not running')
+            return None
+        try:
+            with open(self.filename, 'r', encoding='utf-8') as f:
+                header = f.readline().split()
+                if len(header) != 4 or header[:3] != ['lttp-watch-journal', str(VERSION), self.filter_key]:
+                    logging.info('watch journal does not match the configuration')
+                    return None
+                ready = False
+                changes = None
+                for line in f:
+                    command, _, argument = line.rstrip('\n').partition(' ')
+                    if command == 'ready':
+                        ready = True
+                    elif command == 'mark':
+                        if ready and argument == token:
+                            changes = Changes()
+                    elif command in ('overflow', 'stopped'):
+                        if changes is not None:
+                            logging.info('watch journal: {}'.format(command))
+                            return None
+                    elif changes is not None:
+                        path = unescape(argument.replace('\\ ', '\\x20'))
+                        if command == 'dir':
+                            changes.dirs.add(path)
+                        elif command == 'tree':
+                            changes.trees.add(path)
+                        else:
+                            raise ValueError('unknown command: {!r}'.format(command))
+        except FileNotFoundError:
+            return None
+        except ValueError as e:
+            logging.warning('watch journal is damaged, not used: {}'.format(e))
+            return None
+        if changes is None:
+            logging.info('watch journal: last backup was not made while watching')
+        return changes
+
+    @staticmethod
+    def read_mark(backup_path):
+        """Return the token stored in a backup or None"""
+        try:
+            with open(os.path.join(backup_path, MARK_NAME), 'r', encoding='utf-8') as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def save_mark(backup_path, token):
+        """Store the token in a backup"""
+        with open(os.path.join(backup_path, MARK_NAME), 'w', encoding='utf-8') as f:
+            f.write('{}\n'.format(token))
@@ -24,9 +24,22 @@ class Restore(Backup):
     def __init__(self):
         Backup.__init__(self)
         self.root = filelist.FileList()
+        # if set, only these paths are loaded from the file list (when it
+        # has an index), with their contents if recursive is true
+        self.paths = None
+        self.recursive = True
+
+    def load_configuration(self, filename):
+        Backup.load_configuration(self, filename)
+        # the configuration may select an other type of file list
+        self.root = self.new_file_list()
 
     def load_file_list(self):
-        self.root.load(os.path.join(self.current_backup_path, 'file_list'))
+        file_list = os.path.join(self.current_backup_path, 'file_list')
+        if self.paths is not None and os.path.exists(file_list + filelist.INDEX_SUFFIX):
+            self.root.load_paths(file_list, self.paths, self.recursive)
+        else:
+            self.root.load(file_list)
 
     def find_backup_by_time(self, timespec_str=None):
         if timespec_str is None:
@@ -99,13 +112,14 @@ def action_path(args):
 def action_ls(args):
     """show file list"""
     b = Restore()
-    b.evaluate_arguments(args)
     if not args.PATH:
         args.PATH.append('.')
+    args.PATH = [os.path.abspath(path) for path in args.PATH]
+    b.paths = args.PATH
+    b.recursive = args.recursive
+    b.evaluate_arguments(args)
 
     for path in args.PATH:
-        if not os.path.isabs(path):
-            path = os.path.abspath(path)
         try:
             item = b.root[path]
         except KeyError as e:
@@ -125,18 +139,21 @@ def action_ls(args):
 def action_cp(args):
     """copy/extract files/dirs"""
     b = Restore()
-    b.evaluate_arguments(args)
     if not os.path.isabs(args.SRC):
         args.SRC = os.path.abspath(args.SRC)
+    b.paths = [args.SRC]
+    b.evaluate_arguments(args)
     b.cp(args.SRC, args.DST, args.recursive)
 
 
 def action_cat(args):
     """show contents of backuped file"""
     b = Restore()
-    b.evaluate_arguments(args)
     if not os.path.isabs(args.SRC):
         args.SRC = os.path.abspath(args.SRC)
+    b.paths = [args.SRC]
+    b.recursive = False
+    b.evaluate_arguments(args)
     try:
         item = b.root[args.SRC]
     except KeyError as e:
@@ -41,6 +41,31 @@ def nice_bytes(value):
         return '{:.0f}B'.format(value)
 
 
+def parse_bytes(text):
+    """\
+    The inverse of nice_bytes: convert a string with an optional unit to a
+    number of bytes.
+
+    >>> parse_bytes('48')
+    48
+    >>> parse_bytes('1.5kB')
+    1500
+    >>> parse_bytes('20G')
+    20000000000
+    """
+    text = text.strip()
+    if text.endswith('B'):
+        text = text[:-1]
+    exp = 0
+    if text and text[-1] in EXPONENTS[1:]:
+        exp = EXPONENTS.index(text[-1])
+        text = text[:-1]
+    value = int(float(text) * 1000 ** exp)
+    if value < 0:
+        raise ValueError('Byte count can not be negative: {}'.format(value))
+    return value
+
+
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 def mode_to_chars(mode):
     """\
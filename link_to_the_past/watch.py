@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# (C) 2012-2016 Chris Liechti <cliechti@gmx.net>
+#
+# SPDX-License-Identifier:    BSD-3-Clause
+"""\
+Link To The Past - a backup tool
+
+Watch the sources for changes (Linux inotify) and record the changed
+directories in the journal of the target (see journal), so that the next
+backup only needs to read these directories.
+"""
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import signal
+import stat
+import struct
+
+from .backup import Backup
+from .create import Create
+from .error import BackupException
+from .journal import Journal
+from .string_escape import escaped
+
+# from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+# events that change the list of names in a directory
+IN_LISTING = IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_LISTING | IN_DELETE_SELF | IN_MOVE_SELF |
+              IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK)
+
+EVENT_HEADER = struct.Struct('iIII')    # wd, mask, cookie, len
+
+
+class Inotify(object):
+    """Minimal interface to the inotify system calls of the C library"""
+
+    def __init__(self):
+        name = ctypes.util.find_library('c')
+        try:
+            libc = ctypes.CDLL(name, use_errno=True)
+            self._add_watch = libc.inotify_add_watch
+            self._rm_watch = libc.inotify_rm_watch
+            init = libc.inotify_init1
+        except (OSError, AttributeError):
+            raise BackupException('inotify is not supported on this system')
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self.fd = init(IN_CLOEXEC)
+        if self.fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+
+    def close(self):
+        os.close(self.fd)
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        """Watch a directory, return the watch descriptor"""
+        wd = self._add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e), path)
+        return wd
+
+    def rm_watch(self, wd):
+        self._rm_watch(self.fd, wd)
+
+    def read_events(self, timeout=None):
+        """Wait for events, return a list of (wd, mask, name) tuples"""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        data = os.read(self.fd, 65536)
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            events.append((wd, mask, name))
+        return events
+
+
+class Watcher(object):
+    """Watch the locations of an indexer and record changes in a journal"""
+
+    def __init__(self, indexer, journal):
+        self.indexer = indexer
+        self.journal = journal
+        self.inotify = None
+        self.paths = {}     # wd -> path
+        self.running = False
+
+    def watch_tree(self, path, device):
+        """Watch a directory and all directories below, on the same device"""
+        try:
+            self.paths[self.inotify.add_watch(path)] = path
+        except OSError as e:
+            if e.errno == errno.ENOSPC:
+                logging.error('too many watches (see /proc/sys/fs/inotify/max_user_watches)')
+                self.journal.write('overflow')
+            elif e.errno != errno.ENOENT:
+                logging.error('can not watch {}: {}'.format(escaped(path), e))
+            return
+        try:
+            direntries = list(os.scandir(path))
+        except OSError as e:
+            logging.error('can not read {}: {}'.format(escaped(path), e))
+            return
+        for direntry in direntries:
+            if not self.indexer.is_included(direntry.path):
+                continue
+            try:
+                stat_now = direntry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            if stat.S_ISDIR(stat_now.st_mode) and stat_now.st_dev == device:
+                self.watch_tree(direntry.path, device)
+
+    def unwatch_tree(self, path):
+        """Stop watching a directory and all directories below it"""
+        prefix = path + os.sep
+        for wd, watched in list(self.paths.items()):
+            if watched == path or watched.startswith(prefix):
+                self.inotify.rm_watch(wd)
+                del self.paths[wd]
+
+    def handle(self, wd, mask, name):
+        """Record one event in the journal"""
+        if mask & IN_Q_OVERFLOW:
+            logging.warning('events were lost, the next backup will scan all directories')
+            self.journal.write('overflow')
+            return
+        path = self.paths.get(wd)
+        if path is None:
+            return
+        if mask & IN_IGNORED:
+            del self.paths[wd]
+            return
+        if not name:
+            # the directory itself, its meta data is part of the parent
+            self.journal.write('dir', os.path.dirname(path))
+            return
+        full_path = os.path.join(path, name)
+        if not self.indexer.is_included(full_path):
+            return
+        self.journal.write('dir', path)
+        if mask & IN_LISTING:
+            # the modification time of the directory has changed
+            self.journal.write('dir', os.path.dirname(path))
+            if mask & IN_ISDIR:
+                if mask & (IN_MOVED_FROM | IN_DELETE):
+                    self.unwatch_tree(full_path)
+                else:
+                    self.journal.write('tree', full_path)
+                    self.watch_tree(full_path, os.stat(path).st_dev)
+
+    def stop(self, *args):
+        self.running = False
+
+    def run(self):
+        """Watch until stopped by SIGTERM or SIGINT"""
+        self.inotify = Inotify()
+        self.journal.start()
+        try:
+            for location in self.indexer.includes:
+                logging.info('watching {}'.format(escaped(location.path)))
+                self.watch_tree(location.path, os.stat(location.path).st_dev)
+            logging.info('watching {} directories'.format(len(self.paths)))
+            self.journal.write('ready')
+            self.running = True
+            signal.signal(signal.SIGTERM, self.stop)
+            while self.running:
+                for wd, mask, name in self.inotify.read_events(timeout=1):
+                    self.handle(wd, mask, name)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.journal.stop()
+            self.inotify.close()
+
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+def action_watch(args):
+    b = Create()
+    # only the common options, there are no scan options
+    Backup.evaluate_arguments(b, args)
+    if not os.path.isdir(b.target_path):
+        os.mkdir(b.target_path)
+    Watcher(b.indexer, Journal(b.target_path, b.indexer.filter_checksum())).run()
+
+
+def update_argparse(subparsers):
+    """Add a sub-parser for the actions provided by this module"""
+    parser = subparsers.add_parser(
+        'watch',
+        description='Watch the sources for changes and record them in a '
+                    'journal in the target, so that "create" only needs to '
+                    'read changed directories. Runs until terminated. '
+                    'Linux only (inotify).',
+        help='record changes of the sources for faster backups')
+    parser.set_defaults(func=action_watch)
+
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+def main():
+    import doctest
+    doctest.testmod()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""\
+Trees of fake files for the benchmarks and checks of the file lists: a
+stat result without a file system and a tree of directories with 100 files
+each.
+"""
+import sys
+sys.path.append('..')
+
+from link_to_the_past import filelist
+
+
+class FakeStat(object):
+    st_mode = 0o100644
+    st_uid = 1000
+    st_gid = 1000
+    st_size = 1234
+    st_mtime = 1400000000.123456
+    st_atime = 1400000000.654321
+    st_ctime = 1400000000.123456
+    st_dev = 2049
+    st_ino = 1
+
+
+class FakeDirStat(FakeStat):
+    st_mode = 0o040755
+
+
+def make_tree(root, count):
+    """\
+    Add count files to root (a FileList or CompactFileList), 100 per
+    directory in /home/user/dir N. Every third name has special characters.
+    Returns root.
+    """
+    root.set_hash('SHA-256')
+    directory = root.new_dir('home', stat_now=FakeDirStat()).new_dir('user', stat_now=FakeDirStat())
+    for n in range(count):
+        if n % 100 == 0:
+            subdirectory = directory.new_dir('dir {}'.format(n), stat_now=FakeDirStat())
+        entry = subdirectory.new_file('file_{}.txt'.format(n) if n % 3 else 'fïle #{}'.format(n), stat_now=FakeStat())
+        entry.data_hash = '{:064x}'.format(n)
+    return root
+
+
+def make_file_list(filename, count):
+    """Write a file list with the tree of make_tree"""
+    make_tree(filelist.FileList(), count).save(filename)
+
+
+def listing(root):
+    """The paths and meta data of all entries, to compare trees"""
+    return [(e.path, e.name, e.stat.mode, e.stat.uid, e.stat.gid, e.stat.size,
+             e.stat.atime, e.stat.mtime, e.stat.ctime, e.stat.flags, e.data_hash)
+            for e in root.flattened()]
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""\
+Memory usage of FileList versus CompactFileList. A tree with ENTRIES files
+(100 per directory) is built in both and the memory that was allocated is
+reported per entry. Also checks that both result in the same listing and
+compare without differences, and the lookup of entries by name (run by
+pytest too).
+
+usage: python3 test_compact.py [ENTRIES]
+"""
+import sys
+import time
+import tracemalloc
+sys.path.append('..')
+
+from link_to_the_past import filelist, compact
+from fake_tree import make_tree, listing
+
+
+def measure(cls, count):
+    tracemalloc.start()
+    t = time.time()
+    root = make_tree(cls(), count)
+    # paths are cached once they were used
+    for entry in root.flattened():
+        entry.path
+    t = time.time() - t
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return root, size, t
+
+
+def check_compact(a, b, count):
+    assert listing(a) == listing(b)
+    for path, dirs, files in a.compare(b):
+        assert not files.changed and not files.added and not files.removed
+    # entries of the compact list are a read-only view
+    directory = b['/home/user/dir 0']
+    assert directory.entries['file_1.txt'].data_hash == '{:064x}'.format(1)
+    assert len(directory.entries) == min(count, 100)
+    try:
+        directory.entries['new.txt'] = directory.entries['file_1.txt']
+    except TypeError:
+        pass
+    else:
+        raise AssertionError('entries are writeable')
+
+
+def test_compact_matches_file_list():
+    check_compact(make_tree(filelist.FileList(), 1000), make_tree(compact.CompactFileList(), 1000), 1000)
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    a, size_a, t_a = measure(filelist.FileList, count)
+    b, size_b, t_b = measure(compact.CompactFileList, count)
+    check_compact(a, b, count)
+    print('FileList        {:6.0f} bytes/entry {:.2f} s'.format(size_a / count, t_a))
+    print('CompactFileList {:6.0f} bytes/entry {:.2f} s'.format(size_b / count, t_b))
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""\
+Benchmark for comparing trees: time of BackupDirectory.compare for a single
+directory with 1k to 1M entries. Each size is run with all entries the same,
+every 10th entry changed and every 10th entry added/removed. The time per
+entry should stay (about) constant. Also checks the results (run by pytest
+too), e.g. that a directory replaced by a file is reported as removed, with
+its contents.
+
+usage: python3 test_compare.py [MAX_ENTRIES]
+"""
+import sys
+import timeit
+sys.path.append('..')
+
+from link_to_the_past import filelist
+from fake_tree import FakeStat
+
+
+def make_tree(count, changed_every=0, renamed_every=0):
+    root = filelist.FileList()
+    directory = root.new_dir('data')
+    st = FakeStat()
+    for n in range(count):
+        if renamed_every and n % renamed_every == 0:
+            name = 'renamed_{}'.format(n)
+        else:
+            name = 'file_{}'.format(n)
+        entry = directory.new_file(name, stat_now=st)
+        if changed_every and n % changed_every == 0:
+            entry.stat.size += 1
+    return root
+
+
+def run_compare(a, b):
+    for path, dirs, files in a.compare(b):
+        pass
+
+
+def changes(a, b):
+    """Count the changed, added and removed files of a compare"""
+    counts = [0, 0, 0]
+    for path, dirs, files in a.compare(b):
+        counts[0] += len(files.changed)
+        counts[1] += len(files.added)
+        counts[2] += len(files.removed)
+    return counts
+
+
+def test_compare():
+    reference = make_tree(1000)
+    assert changes(make_tree(1000), reference) == [0, 0, 0]
+    assert changes(make_tree(1000, changed_every=10), reference) == [100, 0, 0]
+    assert changes(make_tree(1000, renamed_every=10), reference) == [0, 100, 100]
+
+
+def test_type_change():
+    a = make_tree(3)
+    b = make_tree(3)
+    a['/data'].new_file('sub', stat_now=FakeStat())
+    b['/data'].new_dir('sub').new_file('inner', stat_now=FakeStat())
+    added = []
+    removed = []
+    for path, dirs, files in a.compare(b):
+        assert not files.changed
+        added.extend(entry.path for entry in dirs.added + files.added)
+        removed.extend(entry.path for entry in dirs.removed + files.removed)
+    assert added == ['/data/sub'], added
+    assert sorted(removed) == ['/data/sub', '/data/sub/inner'], removed
+
+
+if __name__ == '__main__':
+    test_compare()
+    test_type_change()
+    max_entries = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    count = 1000
+    while count <= max_entries:
+        reference = make_tree(count)
+        for label, kwargs in (('same', {}),
+                              ('changed', {'changed_every': 10}),
+                              ('renamed', {'renamed_every': 10})):
+            tree = make_tree(count, **kwargs)
+            t = min(timeit.repeat(
+                stmt='run_compare(tree, reference)',
+                number=1,
+                repeat=3,
+                globals={'run_compare': run_compare, 'tree': tree, 'reference': reference}))
+            print('{:>8} entries {:8}: {:8.4f} s {:6.3f} us/entry'.format(count, label, t, 1e6 * t / count))
+        count *= 10
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""\
+Benchmark for copying a file with a hash: the simple block loop against the
+threaded pipeline, for some block sizes, writing to the page cache and to a
+simulated disk of 300MB/s (the pipeline only helps when writes block).
+Also checks that both produce the same copy and hash, and the detection of
+sparse files.
+
+usage: python3 test_copier.py [MEGABYTES [HASH]]
+"""
+import os
+import sys
+import tempfile
+import time
+import timeit
+sys.path.append('..')
+
+from link_to_the_past import copier, hashes
+
+
+class SlowWriter(object):
+    """Writes take as long as on a disk with given bandwidth (without the GIL)"""
+
+    def __init__(self, f, bytes_per_second):
+        self.f = f
+        self.bytes_per_second = bytes_per_second
+
+    def write(self, data):
+        time.sleep(len(data) / self.bytes_per_second)
+        return self.f.write(data)
+
+
+def run(function, src, dst, hash_factory, blocksize, disk=None):
+    h = hash_factory()
+    with open(src, 'rb') as f_src:
+        with open(dst, 'wb') as f_dst:
+            function(f_src, f_dst if disk is None else SlowWriter(f_dst, disk), h, blocksize)
+    return h.hexdigest()
+
+
+def test_sparse_buffered(buffering=65536):
+    """\
+    A sparse copy read through a buffer that is larger than the holes must
+    be the same as the source, with the same hash as a dense read.
+    """
+    hash_factory = hashes.get_factory('SHA-256')
+    with tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, 'source')
+        dst = os.path.join(tmp, 'destination')
+        with open(src, 'wb') as f:
+            f.write(os.urandom(4096))
+            f.seek(8192)
+            f.write(os.urandom(200 * 1024))
+            f.truncate(4 * 1024 * 1024)
+        h = hash_factory()
+        with open(src, 'rb', buffering=buffering) as f_src:
+            with open(dst, 'wb') as f_dst:
+                copier.copy_sparse(f_src, f_dst, h)
+        with open(src, 'rb') as f:
+            data = f.read()
+        with open(dst, 'rb') as f:
+            assert f.read() == data
+        expected = hash_factory()
+        expected.update(data)
+        assert h.hexdigest() == expected.hexdigest()
+        assert copier.hash_file(src, hash_factory) == expected.hexdigest()
+
+
+if __name__ == '__main__':
+    test_sparse_buffered()
+    megabytes = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    hash_factory = hashes.get_factory(sys.argv[2] if len(sys.argv) > 2 else 'SHA-256')
+    with tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, 'source')
+        dst = os.path.join(tmp, 'destination')
+        with open(src, 'wb') as f:
+            for n in range(megabytes):
+                f.write(os.urandom(1024 * 1024))
+        # only files with holes take the sparse path
+        sparse = os.path.join(tmp, 'sparse')
+        with open(sparse, 'wb') as f:
+            f.write(b'data')
+            f.truncate(megabytes * 1024 * 1024)
+        for path, expected in ((src, False), (sparse, True)):
+            with open(path, 'rb') as f:
+                assert copier.is_sparse(f.fileno(), os.fstat(f.fileno())) == expected
+                assert os.lseek(f.fileno(), 0, os.SEEK_CUR) == 0
+        assert copier.hash_file(sparse, hash_factory) == copier.copy_file(sparse, dst, hash_factory)
+        os.remove(dst)
+        for disk in (None, 300 * 1024 * 1024):
+            for blocksize in (64 * 1024, copier.BLOCKSIZE, 1024 * 1024):
+                a = run(copier.copy_blocks, src, dst, hash_factory, blocksize, disk)
+                b = run(copier.copy_pipelined, src, dst, hash_factory, blocksize, disk)
+                assert a == b
+                for function in (copier.copy_blocks, copier.copy_pipelined):
+                    t = min(timeit.repeat(
+                        stmt='run(function, src, dst, hash_factory, blocksize, disk)',
+                        number=1,
+                        repeat=3,
+                        globals={'run': run, 'function': function, 'src': src, 'dst': dst,
+                                 'hash_factory': hash_factory, 'blocksize': blocksize, 'disk': disk}))
+                    print('{:15} {:8} bytes/block, {:>11}: {:6.1f} MB/s'.format(
+                        function.__name__, blocksize, 'page cache' if disk is None else '300MB/s disk', megabytes / t))
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""\
+Benchmark for testing paths against many exclude patterns: each ShellPattern
+on its own (fnmatch) against the compiled ExcludeMatcher. Both must give the
+same results.
+
+usage: python3 test_exclude_matcher.py [PATTERNS [PATHS]]
+"""
+import random
+import sys
+import timeit
+sys.path.append('..')
+
+from link_to_the_past import indexer
+
+NAMES = ['src', 'build', 'cache', 'node_modules', '.git', 'home', 'user', 'tmp', 'doc', 'x y']
+EXTENSIONS = ['.c', '.o', '.pyc', '.bak', '.txt', '~', '.tmp', '']
+
+
+def make_patterns(count):
+    patterns = []
+    for n in range(count):
+        kind = n % 5
+        if kind == 0:
+            patterns.append('*{}{}'.format(random.choice(EXTENSIONS) or '.x', n))
+        elif kind == 1:
+            patterns.append('*/{}/*'.format(random.choice(NAMES) + str(n)))
+        elif kind == 2:
+            patterns.append('/{}/{}*'.format(random.choice(NAMES), random.choice(NAMES)))
+        elif kind == 3:
+            patterns.append('*.[ch]{}'.format(n))
+        else:
+            patterns.append('*/{}?{}'.format(random.choice(NAMES), n))
+    # some that match often
+    patterns.extend(['*.bak', '*~', '*/.git', '*/__pycache__/*', '/tmp'])
+    return [indexer.ShellPattern(pattern) for pattern in patterns]
+
+
+def make_paths(count):
+    paths = []
+    for n in range(count):
+        parts = [random.choice(NAMES) for i in range(random.randint(1, 6))]
+        paths.append('/' + '/'.join(parts) + random.choice(EXTENSIONS))
+    return paths
+
+
+def is_included(excludes, path):
+    for exclude in excludes:
+        if exclude.matches(path):
+            return False
+    return True
+
+
+def run_simple(excludes, paths):
+    return [is_included(excludes, path) for path in paths]
+
+
+def run_compiled(excludes, paths):
+    matcher = indexer.ExcludeMatcher(excludes)
+    return [not matcher.matches(path) for path in paths]
+
+
+if __name__ == '__main__':
+    pattern_count = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    path_count = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    random.seed(42)
+    excludes = make_patterns(pattern_count)
+    paths = make_paths(path_count)
+    assert run_simple(excludes, paths) == run_compiled(excludes, paths)
+    for function in (run_simple, run_compiled):
+        t = min(timeit.repeat(
+            stmt='function(excludes, paths)',
+            number=1,
+            repeat=3,
+            globals={'function': function, 'excludes': excludes, 'paths': paths}))
+        print('{:13} {} patterns, {} paths: {:.3f} s'.format(function.__name__, pattern_count, path_count, t))
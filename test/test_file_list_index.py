@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""\
+Benchmark for looking up a single path: loading the complete file list
+against loading only the path with the help of the index, in both formats.
+The entries loaded via the index must be the same as in the complete list.
+
+usage: python3 test_file_list_index.py [ENTRIES]
+"""
+import os
+import sys
+import tempfile
+import timeit
+sys.path.append('..')
+
+from link_to_the_past import filelist
+from fake_tree import make_file_list, listing
+
+
+def load_all(filename, path):
+    root = filelist.FileList()
+    root.load(filename)
+    return root[path]
+
+
+def load_indexed(filename, path):
+    root = filelist.FileList()
+    root.load_paths(filename, [path], recursive=False)
+    return root[path]
+
+
+def check_indexed(filename, root, path):
+    assert sorted(listing(load_indexed(filename, path))) == sorted(listing(load_all(filename, path)))
+    # the root has no record of its own, its top level is loaded
+    assert [e.path for e in load_indexed(filename, root.path)] == [e.path for e in root]
+
+
+def test_indexed_matches_full_load():
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, 'file_list')
+        make_file_list(filename, 1000)
+        root = filelist.FileList()
+        root.load(filename)
+        for file_format in filelist.FILE_LIST_FORMATS:
+            root.save(filename, file_format, index=True)
+            check_indexed(filename, root, '/home/user/dir 500')
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    path = '/home/user/dir {}'.format(count // 200 * 100)
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, 'file_list')
+        make_file_list(filename, count)
+        root = filelist.FileList()
+        root.load(filename)
+        for file_format in filelist.FILE_LIST_FORMATS:
+            root.save(filename, file_format, index=True)
+            check_indexed(filename, root, path)
+            for function in (load_all, load_indexed):
+                t = min(timeit.repeat(
+                    stmt='function(filename, path)',
+                    number=1,
+                    repeat=3,
+                    globals={'function': function, 'filename': filename, 'path': path}))
+                print('{} {:12} {} entries: {:.4f} s'.format(file_format, function.__name__, count, t))
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""\
+Benchmark for loading p1 file lists: FileListParser (word by word) against
+the line oriented reader used by FileList.load. Both must result in the
+same tree.
+
+usage: python3 test_file_list_parser.py [ENTRIES]
+"""
+import os
+import sys
+import tempfile
+import timeit
+sys.path.append('..')
+
+from link_to_the_past import filelist
+from fake_tree import make_file_list, listing
+
+
+def load_parser(filename):
+    root = filelist.FileList()
+    filelist.FileListParser(root).load_file(filename, quick=True)
+    return root
+
+
+def load_reader(filename):
+    root = filelist.FileList()
+    root.load(filename)
+    return root
+
+
+def check_parser(filename):
+    a = load_parser(filename)
+    b = load_reader(filename)
+    assert a.hash_name == b.hash_name
+    assert listing(a) == listing(b)
+
+
+def test_parser_matches_reader():
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, 'file_list')
+        make_file_list(filename, 1000)
+        check_parser(filename)
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, 'file_list')
+        make_file_list(filename, count)
+        check_parser(filename)
+        for function in (load_parser, load_reader):
+            t = min(timeit.repeat(
+                stmt='function(filename)',
+                number=1,
+                repeat=3,
+                globals={'function': function, 'filename': filename}))
+            print('{:12} {} entries: {:.3f} s'.format(function.__name__, count, t))